@@ -0,0 +1,221 @@
+# backend/analytics.py
+"""
+列式统计：把用户行程的统计字段一次性读成 NumPy 数组，向量化计算
+累计量、各类直方图以及“旅行 DNA”等派生指标。
+
+user_stats 的全量计算（老用户首次读取、--rebuild 重建）走这里；
+日常增量维护仍按单个行程的贡献加减。
+"""
+from collections import Counter
+from datetime import date, datetime
+from itertools import chain
+from typing import Any, Dict, List, Mapping, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import Trip
+
+# 统计用到的行程字段：只有这些字段变化才需要更新统计
+STAT_FIELDS = ("user_id", "destination", "days", "people", "budget", "actual_cost",
+               "tags", "status", "start_date", "created_at", "latitude", "longitude")
+
+# 计算旅行距离的出发地（北京）
+HOME_LAT, HOME_LON = 39.9042, 116.4074
+EARTH_RADIUS_KM = 6371
+
+SEASONS = {"12": "冬季", "01": "冬季", "02": "冬季", "03": "春季", "04": "春季", "05": "春季",
+           "06": "夏季", "07": "夏季", "08": "夏季", "09": "秋季", "10": "秋季", "11": "秋季"}
+_SEASON_BY_MONTH = [SEASONS[f"{m:02d}"] for m in range(1, 13)]
+
+# 预算档位：budget < 1000 经济，< 3000 适中，其余（含空值）豪华
+BUDGET_ECONOMY, BUDGET_MODERATE = 1000, 3000
+
+
+def budget_level(budget) -> str:
+    # 与 SQL CASE 语义一致：budget 为空时落入最后一档
+    if budget is not None and budget < BUDGET_ECONOMY:
+        return "经济"
+    if budget is not None and budget < BUDGET_MODERATE:
+        return "适中"
+    return "豪华"
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _to_days(values: Sequence) -> np.ndarray:
+    """
+    datetime / "YYYY-MM-DD[ HH:MM:SS]" 字符串 / None 统一转为按天截断的 datetime64（None -> NaT）。
+    日期对象走 toordinal，比让 NumPy 逐个解析 Python 对象快一个数量级。
+    """
+    ordinals = np.array([v.toordinal() if isinstance(v, date) else 0 for v in values], dtype=np.int64)
+    result = (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+    result[ordinals == 0] = np.datetime64("NaT")
+    strings = [(i, v) for i, v in enumerate(values) if isinstance(v, str)]
+    if strings:
+        positions, texts = zip(*strings)
+        result[list(positions)] = np.array(texts, dtype="datetime64[us]").astype("datetime64[D]")
+    return result
+
+
+def trip_columns(rows: Sequence[Sequence[Any]]) -> Dict[str, np.ndarray]:
+    """把按 STAT_FIELDS 顺序的行转成列数组（数值列的 None 转为 NaN，日期列转为 NaT）"""
+    columns = list(zip(*rows)) if rows else [()] * len(STAT_FIELDS)
+    raw = dict(zip(STAT_FIELDS, columns))
+    return {
+        "destination": np.array(raw["destination"], dtype=object),
+        "days": np.array(raw["days"], dtype=float),
+        "people": np.array(raw["people"], dtype=float),
+        "budget": np.array(raw["budget"], dtype=float),
+        "actual_cost": np.array(raw["actual_cost"], dtype=float),
+        "tags": list(raw["tags"]),
+        "status": np.array(raw["status"], dtype=object),
+        "start_date": _to_days(raw["start_date"]),
+        "created_at": _to_days(raw["created_at"]),
+        "latitude": np.array(raw["latitude"], dtype=float),
+        "longitude": np.array(raw["longitude"], dtype=float),
+    }
+
+
+def load_trip_columns(db: Session, user_id: int) -> Dict[str, np.ndarray]:
+    """一次查询只取统计需要的列，不构造 ORM 对象"""
+    rows = db.query(*(getattr(Trip, name) for name in STAT_FIELDS)) \
+        .filter(Trip.user_id == user_id).all()
+    return trip_columns(rows)
+
+
+def haversine_km(lat: np.ndarray, lon: np.ndarray, home_lat: float = HOME_LAT, home_lon: float = HOME_LON) -> np.ndarray:
+    """向量化大圆距离 (km)"""
+    lat1, lon1 = np.radians(home_lat), np.radians(home_lon)
+    lat2, lon2 = np.radians(lat), np.radians(lon)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _label_counts(labels: Sequence[str], counts: np.ndarray) -> Dict[str, int]:
+    return {label: int(count) for label, count in zip(labels, counts) if count}
+
+
+def aggregate_trip_columns(columns: Dict[str, np.ndarray], today=None) -> Dict[str, Any]:
+    """
+    向量化计算 user_stats 的全部累计字段，语义与 user_stats.trip_contribution 逐条相加一致。
+    返回值可直接赋给 UserStats 行（均为 Python 原生类型）。
+    """
+    days = np.nan_to_num(columns["days"])
+    people = np.nan_to_num(columns["people"])
+    budget = columns["budget"]
+    budget_or_zero = np.nan_to_num(budget)
+    actual_cost = columns["actual_cost"]
+
+    # 提前规划天数：没有出发日期的行程不计；创建时间缺失按今天算
+    start = columns["start_date"]
+    has_start = ~np.isnat(start)
+    today = np.datetime64(today or datetime.utcnow().date(), "D")
+    created = np.where(np.isnat(columns["created_at"]), today, columns["created_at"])
+    lead_times = np.maximum(0, (start[has_start] - created[has_start]).astype(np.int64))
+
+    # 人均每日花费：天数与人数都为正才计入
+    per_day = (days > 0) & (people > 0)
+    cpppd = budget_or_zero[per_day] / (days[per_day] * people[per_day])
+
+    # 往返距离：坐标缺失（或为 0）的行程不计
+    lat, lon = columns["latitude"], columns["longitude"]
+    located = ~np.isnan(lat) & ~np.isnan(lon) & (lat != 0) & (lon != 0)
+    distances = haversine_km(lat[located], lon[located]) * 2
+
+    # 月份/季节/预算档位是整数编码，用 bincount 计数
+    months = start[has_start].astype("datetime64[M]").astype(np.int64)  # 1970-01 为 0
+    month_codes, month_totals = np.unique(months, return_counts=True)
+    month_names = np.datetime_as_string(month_codes.astype("datetime64[M]"), unit="M")
+    season_totals = Counter()
+    for month, count in enumerate(np.bincount(months % 12, minlength=12)):
+        season_totals[_SEASON_BY_MONTH[month]] += int(count)
+    budget_totals = (
+        np.count_nonzero(budget < BUDGET_ECONOMY),
+        np.count_nonzero((budget >= BUDGET_ECONOMY) & (budget < BUDGET_MODERATE)),
+        np.count_nonzero(~(budget < BUDGET_MODERATE)),  # NaN 落入豪华
+    )
+
+    # 城市与标签是任意字符串：Counter 在 C 层计数，且保持首次出现顺序（与逐条累加一致）
+    cities = Counter(d for d in columns["destination"] if d)
+    tags = Counter(chain.from_iterable(t for t in columns["tags"] if isinstance(t, list)))
+
+    return {
+        "total_trips": int(len(days)),
+        "completed_trips": int(np.count_nonzero(columns["status"] == "completed")),
+        "total_spent": float(np.where(np.isnan(actual_cost), budget_or_zero, actual_cost).sum()),
+        "total_budget": float(budget_or_zero.sum()),
+        "total_days": int(days.sum()),
+        "total_people": int(np.where(people != 0, people, 1).sum()),
+        "lead_time_sum": float(lead_times.sum()),
+        "lead_time_count": int(len(lead_times)),
+        "cpppd_sum": float(cpppd.sum()),
+        "cpppd_count": int(len(cpppd)),
+        "distance_sum": float(distances.sum()),
+        "city_counts": dict(cities),
+        "tag_counts": dict(tags),
+        "month_counts": _label_counts(month_names, month_totals),
+        "season_counts": {season: count for season, count in season_totals.items() if count},
+        "budget_counts": _label_counts(("经济", "适中", "豪华"), budget_totals),
+    }
+
+
+def _sorted_items(counter) -> List[tuple]:
+    return sorted((counter or {}).items())
+
+
+def build_stats_details(totals: Mapping[str, Any]) -> Dict[str, Any]:
+    """由累计字段推导“高阶数据分析”接口的返回（KPI、旅行 DNA、各类分布）"""
+    total_trips = totals.get("total_trips") or 0
+    if total_trips == 0:
+        return {
+            "success": True,
+            "empty": True,
+            "monthly_frequency": [], "budget_distribution": [], "season_preference": [],
+            "advanced_stats": {
+                "travel_dna": [{"subject": "无数据", "A": 0, "fullMark": 100}],
+                "kpi": {}
+            }
+        }
+
+    total_days = totals.get("total_days") or 0
+    lead_time_count = totals.get("lead_time_count") or 0
+    cpppd_count = totals.get("cpppd_count") or 0
+    avg_lead_time = totals["lead_time_sum"] / lead_time_count if lead_time_count else 0
+    avg_cpppd = totals["cpppd_sum"] / cpppd_count if cpppd_count else 0
+    avg_people = (totals.get("total_people") or 0) / total_trips
+    avg_days = total_days / total_trips
+    unique_cities = len(totals.get("city_counts") or {})
+
+    # 旅行 DNA：各维度归一化到 0-100
+    scores = np.clip([
+        unique_cities / total_trips * 100,        # 探索度
+        avg_cpppd / 2000 * 100,                   # 奢华度
+        avg_people / 6 * 100,                     # 社交度
+        100 - avg_lead_time / 60 * 100,           # 行动力
+        (7 - avg_days) * 20 + 20,                 # 特种兵
+    ], 0, 100).astype(int)
+    subjects = ("探索度", "奢华度", "社交度", "行动力", "特种兵")
+
+    return {
+        "success": True,
+        "basic_stats": {
+            "total_trips": total_trips,
+            "total_days": total_days,
+            "total_spent": totals.get("total_budget") or 0,
+            "completed_trips": totals.get("completed_trips") or 0
+        },
+        "advanced_stats": {
+            "travel_dna": [{"subject": s, "A": int(a), "fullMark": 100} for s, a in zip(subjects, scores)],
+            "kpi": {
+                "total_distance_km": int(totals.get("distance_sum") or 0),
+                "avg_lead_time_days": int(avg_lead_time),
+                "avg_spend_per_person_day": int(avg_cpppd)
+            }
+        },
+        # 与原 GROUP BY 输出顺序一致：按分组键排序
+        "monthly_frequency": [{"month": m, "trip_count": n} for m, n in _sorted_items(totals.get("month_counts"))],
+        "budget_distribution": [{"level": b, "count": n} for b, n in _sorted_items(totals.get("budget_counts"))],
+        "season_preference": [{"season": k, "count": n} for k, n in _sorted_items(totals.get("season_counts"))]
+    }
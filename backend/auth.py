@@ -17,6 +17,8 @@ pwd_context = CryptContext(
     pbkdf2_sha256__default_rounds=30000
 )
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+# 可选登录：未携带或携带无效 token 时不报错，返回 None
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -71,3 +73,15 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="用户已被禁用")
     return current_user
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme), db: Session = Depends(get_db)) -> Optional[User]:
+    """已登录则返回当前用户，匿名访问返回 None"""
+    if not token:
+        return None
+    payload = verify_token(token)
+    if payload is None or payload.get("sub") is None:
+        return None
+    user = db.query(User).filter(User.username == payload.get("sub")).first()
+    if user is None or not user.is_active:
+        return None
+    return user
@@ -0,0 +1,125 @@
+"""
+Benchmark: LLM tool-call latency of tools.amap_tool against a local stub AMap server.
+
+Compares the old behaviour (a fresh httpx.AsyncClient per call, i.e. a new
+TCP connection every time) with the shared module-level client. Both sides send
+the same request and parse it the same way; the old side's cost is mostly
+building the client (its default SSL context) plus the TCP handshake.
+
+Usage (from backend/):
+    python -m benchmarks.bench_amap_tool [--calls 200] [--latency-ms 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from tools import amap_tool
+
+STUB_RESPONSE = json.dumps({
+    "status": "1",
+    "count": "1",
+    "pois": [{
+        "name": "西湖",
+        "address": "杭州市西湖区",
+        "location": "120.141,30.259",
+        "type": "风景名胜",
+        "tel": "N/A",
+        "distance": "120"
+    }]
+}, ensure_ascii=False).encode("utf-8")
+
+
+class StubAmapHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Headers and body go out in one segment; otherwise Nagle plus the client's
+    # delayed ACK stalls every keep-alive response by ~40ms and swamps the comparison.
+    disable_nagle_algorithm = True
+    wbufsize = -1  # buffered; handle_one_request flushes after do_GET
+    latency = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(STUB_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(STUB_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency_ms: float):
+    StubAmapHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAmapHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def search_poi_fresh_client(keywords: str, city: str = "", api_key: str = "bench"):
+    """The pre-change search_poi: same request and parsing, one AsyncClient per invocation."""
+    params = {
+        "key": api_key,
+        "keywords": keywords,
+        "city": city,
+        "offset": 5,
+        "page": 1,
+        "extensions": "all"
+    }
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.get(f"{amap_tool.AMAP_BASE_URL}/place/text", params=params)
+            data = response.json()
+            if data["status"] == "1" and int(data["count"]) > 0:
+                return [{
+                    "name": poi["name"],
+                    "address": poi["address"],
+                    "location": poi["location"],
+                    "type": poi["type"],
+                    "tel": poi.get("tel", "N/A")
+                } for poi in data["pois"]]
+            return []
+        except Exception as e:
+            print(f"Error calling Amap API: {e}")
+            return []
+
+
+async def measure(label: str, call, n: int):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f"{label:<22} mean={statistics.mean(latencies):7.2f}ms  "
+          f"p50={latencies[n // 2]:7.2f}ms  p95={latencies[int(n * 0.95) - 1]:7.2f}ms")
+
+
+async def main(calls: int, latency_ms: float):
+    server = start_stub_server(latency_ms)
+    amap_tool.AMAP_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"stub AMap at {amap_tool.AMAP_BASE_URL}, {calls} sequential calls\n")
+
+    await measure("fresh client (before)", lambda: search_poi_fresh_client("西湖"), calls)
+    await amap_tool.init_client()
+    await measure("shared client (after)", lambda: amap_tool.search_poi("西湖", api_key="bench"), calls)
+    await amap_tool.close_client()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="artificial server latency")
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.latency_ms))
@@ -0,0 +1,108 @@
+"""
+Benchmark: full per-user stats computation (the work behind /api/dashboard/stats-details
+when a user_stats row is built or rebuilt) on synthetic trips.
+
+Compares the per-trip Python loop (user_stats.trip_contribution folded into plain counters)
+with the columnar NumPy path in analytics, and checks that both produce the same stats.
+
+Usage (from backend/):
+    python -m benchmarks.bench_stats_details [--trips 100000] [--repeat 3]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import STAT_FIELDS, aggregate_trip_columns, build_stats_details, trip_columns
+from user_stats import COUNTER_FIELDS, SUM_FIELDS, trip_contribution
+
+CITIES = {
+    "北京": (39.90, 116.41), "上海": (31.23, 121.47), "杭州": (30.27, 120.16),
+    "成都": (30.57, 104.07), "西安": (34.34, 108.94), "厦门": (24.48, 118.09),
+    "大理": (25.61, 100.27), "三亚": (18.25, 109.51), "哈尔滨": (45.80, 126.53),
+    "拉萨": (29.65, 91.17),
+}
+TAGS = ["美食", "文化", "自然", "购物", "亲子", "摄影", "徒步", "海岛"]
+STATUSES = ["planned", "ongoing", "completed"]
+
+
+def synthetic_rows(n: int, seed: int = 42):
+    rng = random.Random(seed)
+    base = datetime(2022, 1, 1)
+    cities = list(CITIES)
+    rows = []
+    for _ in range(n):
+        city = rng.choice(cities)
+        lat, lon = CITIES[city]
+        located = rng.random() < 0.8
+        created = base + timedelta(days=rng.randint(0, 900), seconds=rng.randint(0, 86399))
+        start = created + timedelta(days=rng.randint(-5, 120)) if rng.random() < 0.9 else None
+        budget = rng.choice([None, rng.uniform(200, 20000)])
+        rows.append((
+            1, city, rng.randint(0, 14), rng.choice([0, 1, 2, 3, 4, None]), budget,
+            rng.choice([None, rng.uniform(200, 20000)]),
+            rng.sample(TAGS, rng.randint(0, 3)), rng.choice(STATUSES), start, created,
+            lat if located else None, lon if located else None,
+        ))
+    return rows
+
+
+def loop_stats(rows):
+    stats = {**{name: 0 for name in SUM_FIELDS}, **{name: {} for name in COUNTER_FIELDS}}
+    for row in rows:
+        contribution = trip_contribution(dict(zip(STAT_FIELDS, row)))
+        for name in SUM_FIELDS:
+            stats[name] += contribution[name]
+        for name in COUNTER_FIELDS:
+            counter = stats[name]
+            for key, count in contribution[name].items():
+                counter[key] = counter.get(key, 0) + count
+    return stats
+
+
+def columnar_stats(rows):
+    return aggregate_trip_columns(trip_columns(rows))
+
+
+def check_equal(expected, actual):
+    for name in SUM_FIELDS:
+        assert math.isclose(expected[name], actual[name], rel_tol=1e-9, abs_tol=1e-6), \
+            f"{name}: {expected[name]} != {actual[name]}"
+    for name in COUNTER_FIELDS:
+        assert expected[name] == actual[name], f"{name} differs"
+    # top_counts breaks ties by first occurrence, so key order matters for these two
+    for name in ("city_counts", "tag_counts"):
+        assert list(expected[name]) == list(actual[name]), f"{name} key order differs"
+
+
+def measure(label: str, fn, rows, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(rows)
+        build_stats_details(result)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<18} best={min(timings):9.1f}ms  mean={sum(timings) / len(timings):9.1f}ms")
+    return result
+
+
+def main(trips: int, repeat: int):
+    rows = synthetic_rows(trips)
+    print(f"{trips} synthetic trips for one user, best of {repeat}\n")
+    expected = measure("python loop", loop_stats, rows, repeat)
+    actual = measure("numpy columnar", columnar_stats, rows, repeat)
+    check_equal(expected, actual)
+    print("\nresults match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trips", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.trips, args.repeat)
@@ -0,0 +1,114 @@
+# backend/bm25_index.py
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from local_embedding import normalize_text
+
+_ASCII_WORD = re.compile(r"^[a-z0-9_]+$")
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文/数字按单词，中文等按字符二元组（单字片段保留单字）"""
+    tokens = []
+    for segment in normalize_text(text).split():
+        if _ASCII_WORD.match(segment) or len(segment) == 1:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+class BM25Index:
+    """内存倒排索引 + BM25 打分，支持增量增删文档"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Tuple[str, str, int, Dict[str, Any]]] = {}  # id -> (原文, 归一化文本, 长度, 元数据)
+        self._postings: Dict[str, Dict[str, int]] = {}  # token -> {id: 词频}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]] = None):
+        """加入文档；id 已存在时替换"""
+        tf = Counter(tokenize(text))
+        length = sum(tf.values())
+        with self._lock:
+            if doc_id in self._docs:
+                self.remove(doc_id)
+            self._docs[doc_id] = (text, normalize_text(text), length, metadata or {})
+            self._total_length += length
+            for token, count in tf.items():
+                self._postings.setdefault(token, {})[doc_id] = count
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            entry = self._docs.pop(doc_id, None)
+            if entry is None:
+                return
+            text, _, length, _ = entry
+            self._total_length -= length
+            for token in set(tokenize(text)):
+                postings = self._postings.get(token)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[token]
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._total_length = 0
+
+    def get(self, doc_id: str) -> Optional[str]:
+        entry = self._docs.get(doc_id)
+        return entry[0] if entry else None
+
+    def metadata(self, doc_id: str) -> Dict[str, Any]:
+        entry = self._docs.get(doc_id)
+        return entry[3] if entry else {}
+
+    def contains_phrase(self, doc_id: str, phrase: str) -> bool:
+        """文档（归一化后）是否原样包含该短语"""
+        entry = self._docs.get(doc_id)
+        return bool(entry) and normalize_text(phrase) in entry[1]
+
+    def search(self, query: str, n: int = 10,
+               doc_filter: Optional[Callable[[Dict[str, Any]], bool]] = None) -> List[Tuple[str, float]]:
+        """返回按 BM25 分数降序的 [(id, score)]"""
+        query_tokens = set(tokenize(query))
+        with self._lock:
+            total_docs = len(self._docs)
+            if not total_docs or not query_tokens:
+                return []
+            avg_length = self._total_length / total_docs
+            scores: Dict[str, float] = {}
+            for token in query_tokens:
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id][2]
+                    denom = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / denom
+            if doc_filter is not None:
+                scores = {i: s for i, s in scores.items() if doc_filter(self._docs[i][3])}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """倒数排名融合：score(d) = Σ 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,167 @@
+# backend/chat_memory.py
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from cache_utils import LRUCache, MISSING
+from chunker import estimate_tokens
+from database import ChatSession, ChatMessage
+
+# 提示词预算（估算 token）：系统提示 + 摘要 + 近期原文 + 当前问题
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", 2000))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", 300))
+# 热缓存：最近活跃的会话数，以及每个会话保留的最近消息条数
+CHAT_HOT_SESSIONS = int(os.getenv("CHAT_HOT_SESSIONS", 512))
+CHAT_HOT_MESSAGES = int(os.getenv("CHAT_HOT_MESSAGES", 40))
+# 摘要中每条消息最多保留的字数
+SUMMARY_SNIPPET_CHARS = 60
+
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+
+
+def _first_sentence(text: str) -> str:
+    text = (text or "").strip()
+    match = _SENTENCE_END.search(text)
+    sentence = text[:match.start()] if match else text
+    if len(sentence) > SUMMARY_SNIPPET_CHARS:
+        sentence = sentence[:SUMMARY_SNIPPET_CHARS] + "…"
+    return sentence
+
+
+def summarize_turns(history: List[Dict[str, str]], max_tokens: int = CHAT_SUMMARY_TOKENS) -> str:
+    """
+    抽取式摘要：每条消息取首句，从最近往前收录直到预算用完，再按时间顺序输出。
+    不调用大模型，保证组装提示词的耗时与会话长度无关。
+    """
+    lines, used = [], 0
+    for msg in reversed(history):
+        sentence = _first_sentence(msg["content"])
+        if not sentence:
+            continue
+        line = f"- {'用户' if msg['role'] == 'user' else '助手'}：{sentence}"
+        tokens = estimate_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(reversed(lines))
+
+
+def build_chat_messages(system_prompt: str, history: List[Dict[str, str]], message: str,
+                        budget: int = CHAT_PROMPT_TOKEN_BUDGET,
+                        summary_tokens: int = CHAT_SUMMARY_TOKENS) -> List[Dict[str, str]]:
+    """
+    在 token 预算内组装提示词：从最近一轮往前尽量保留原文，
+    放不下的更早轮次压缩为摘要并入系统提示。
+    """
+    remaining = budget - estimate_tokens(system_prompt) - estimate_tokens(message) - summary_tokens
+    cut = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        tokens = estimate_tokens(history[index]["content"])
+        if tokens > remaining:
+            break
+        remaining -= tokens
+        cut = index
+    # 从 user 消息开始保留，避免以半轮对话开头
+    while cut < len(history) and history[cut]["role"] != "user":
+        cut += 1
+    recent = [{"role": m["role"], "content": m["content"]} for m in history[cut:]]
+
+    system_content = system_prompt
+    summary = summarize_turns(history[:cut], summary_tokens) if cut else ""
+    if summary:
+        system_content += f"\n\n此前对话摘要（较早的轮次）：\n{summary}"
+    return [{"role": "system", "content": system_content}, *recent, {"role": "user", "content": message}]
+
+
+class ChatMemory:
+    """
+    会话记忆：登录用户的每轮对话持久化到 chat_sessions / chat_messages，
+    最近活跃会话的末尾若干条消息保存在进程内 LRU 热缓存。
+    多个 worker 各有自己的热缓存，因此每次读取都先用一次轻量查询
+    （会话最后一条消息的 id）校验缓存，不一致时重新从数据库加载。
+    """
+
+    def __init__(self, hot_sessions: int = CHAT_HOT_SESSIONS, hot_messages: int = CHAT_HOT_MESSAGES):
+        self.hot_messages = hot_messages
+        self._hot = LRUCache(maxsize=hot_sessions)  # key -> (最后一条消息 id, 消息列表)
+        self.stale = 0  # 因其他 worker 写入而失效的缓存次数
+
+    @staticmethod
+    def session_key(user_id: int, session_id: str) -> str:
+        # chat_sessions.session_id 全局唯一，而前端的 session_id（如 "default"）只在用户内唯一
+        return f"{user_id}:{session_id or 'default'}"
+
+    @staticmethod
+    def _session_state(db: Session, user_id: int, key: str):
+        """返回 (会话主键, 最后一条消息 id)；会话不存在时为 (None, None)"""
+        row = db.query(ChatSession.id, func.max(ChatMessage.id)).outerjoin(
+            ChatMessage, ChatMessage.session_id == ChatSession.id
+        ).filter(
+            ChatSession.session_id == key, ChatSession.user_id == user_id
+        ).group_by(ChatSession.id).first()
+        return (row[0], row[1]) if row else (None, None)
+
+    def load(self, db: Session, user_id: int, session_id: str) -> List[Dict[str, str]]:
+        """返回会话最近的消息 [{"role", "content"}]（按时间顺序）"""
+        key = self.session_key(user_id, session_id)
+        session_pk, last_id = self._session_state(db, user_id, key)
+        cached = self._hot.get(key)
+        if cached is not MISSING:
+            if cached[0] == last_id:
+                return list(cached[1])
+            self.stale += 1
+
+        history = []
+        if session_pk is not None:
+            rows = db.query(ChatMessage.role, ChatMessage.content).filter(
+                ChatMessage.session_id == session_pk, ChatMessage.id <= last_id
+            ).order_by(ChatMessage.id.desc()).limit(self.hot_messages).all()
+            history = [{"role": role, "content": content} for role, content in reversed(rows)]
+        self._hot.set(key, (last_id, history))
+        return list(history)
+
+    def append(self, db: Session, user_id: int, session_id: str, message: str, reply: str,
+               metadata: Optional[dict] = None):
+        """持久化一轮问答并更新热缓存"""
+        key = self.session_key(user_id, session_id)
+        session_pk, previous_last_id = self._session_state(db, user_id, key)
+        if session_pk is None:
+            chat_session = ChatSession(user_id=user_id, session_id=key, title=message[:50], message_count=0)
+            db.add(chat_session)
+            db.flush()
+        else:
+            chat_session = db.get(ChatSession, session_pk)
+
+        now = datetime.utcnow()
+        user_msg = ChatMessage(session_id=chat_session.id, role="user", content=message, created_at=now)
+        reply_msg = ChatMessage(session_id=chat_session.id, role="assistant", content=reply,
+                                message_metadata=metadata, created_at=now)
+        db.add_all([user_msg, reply_msg])
+        chat_session.last_message = reply[:500]
+        chat_session.message_count = (chat_session.message_count or 0) + 2
+        chat_session.updated_at = now
+        db.flush()
+        new_last_id = reply_msg.id
+        db.commit()
+
+        # 只有缓存恰好停在写入前的最后一条时才能直接追加；否则（其他 worker 插入过消息）让下次读取重新加载
+        cached = self._hot.get(key)
+        if cached is not MISSING and cached[0] == previous_last_id:
+            history = (list(cached[1]) + [
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": reply},
+            ])[-self.hot_messages:]
+            self._hot.set(key, (new_last_id, history))
+        else:
+            self._hot.pop(key)
+
+    def stats(self):
+        return {**self._hot.stats(), "stale": self.stale}
+
+
+chat_memory = ChatMemory()
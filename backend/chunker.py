@@ -0,0 +1,216 @@
+# backend/chunker.py
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 切分参数（按估算 token 计）：目标长度、相邻块重叠、过短尾块的合并阈值
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", 256))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", 48))
+# 切分规则变化时递增，已导入的文件会按新规则重建
+CHUNKER_VERSION = 5
+
+# 主题关键词：命中任一关键词（含标题路径）即打上 topic_<主题> 标记
+TOPIC_KEYWORDS = {
+    "scams": ("避坑", "防坑", "骗", "宰客", "黑车", "陷阱", "强制消费", "托儿", "假冒"),
+    # 注意事项：闭馆、避开人潮、安全提醒等（不是骗局，单独成类）
+    "safety": ("注意", "避开", "安全", "闭馆", "小心", "警惕", "防滑", "封路"),
+    "food": ("本地胃", "美食", "小吃", "餐", "吃", "火锅", "早茶", "夜市"),
+    "transport": ("交通", "地铁", "公交", "打车", "自驾", "停车", "缆车", "高铁", "机场", "轮渡"),
+    "lodging": ("住宿", "酒店", "民宿", "青旅"),
+    "itinerary": ("路线", "行程", "Day"),
+    "hidden_gems": ("小众", "秘境", "冷门", "私藏", "宝藏"),
+    "budget": ("预算", "省钱", "便宜", "免费", "人均"),
+}
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*$")
+_FILENAME_HEADING = re.compile(r"^\S+\.(?:txt|md)$")
+_CITY_HEADING = re.compile(r"^(.+?)(?:旅游|旅行)(?:贴士|攻略|指南)")
+_TOKEN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;])")
+
+
+def normalize_city(city: str) -> str:
+    """城市名归一化：去掉空白与行政区划后缀（杭州市 -> 杭州）"""
+    city = (city or "").strip()
+    for suffix in ("特别行政区", "市"):
+        if city.endswith(suffix) and len(city) > len(suffix) + 1:
+            return city[:-len(suffix)]
+    return city
+
+
+def detect_topics(text: str) -> List[str]:
+    return [topic for topic, keywords in TOPIC_KEYWORDS.items() if any(k in text for k in keywords)]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略 token 估算：英文/数字按单词计，中文等按单字计"""
+    return len(_TOKEN.findall(text))
+
+
+@dataclass
+class Chunk:
+    text: str
+    metadata: Dict[str, object] = field(default_factory=dict)
+
+
+def iter_lines(file_path: str) -> Iterator[str]:
+    """逐行读取文件，避免一次性载入大文件"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip()
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """超长行先按句切分，单句仍超长则按字符硬切"""
+    pieces, current = [], ""
+    for sentence in filter(None, _SENTENCE_END.split(text)):
+        if current and estimate_tokens(current + sentence) > max_tokens:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current:
+        pieces.append(current)
+
+    result = []
+    for piece in pieces:
+        while estimate_tokens(piece) > max_tokens:
+            result.append(piece[:max_tokens])
+            piece = piece[max_tokens:]
+        if piece:
+            result.append(piece)
+    return result
+
+
+def _iter_blocks(lines: Iterable[str]) -> Iterator[Tuple[str, object]]:
+    """
+    把行流解析为结构块：
+    ("heading", (级别, 标题)) 或 ("block", [行...])。
+    空行分隔段落；列表项连同其后连续书写的子项行归为同一块，
+    超长块再按行切分，保证不把一个列表项拆散到两块之外。
+    """
+    buffer: List[str] = []
+    for line in lines:
+        heading = _HEADING.match(line)
+        if heading and _FILENAME_HEADING.match(heading.group(2)):
+            continue  # 文件名注释行，如 "# knowledge_base/travel_tips.txt"
+        if heading:
+            if buffer:
+                yield "block", buffer
+                buffer = []
+            yield "heading", (len(heading.group(1)), heading.group(2))
+        elif not line.strip():
+            if buffer:
+                yield "block", buffer
+                buffer = []
+        else:
+            buffer.append(line.strip())
+    if buffer:
+        yield "block", buffer
+
+
+class _Section:
+    """当前标题路径与所属城市"""
+
+    def __init__(self):
+        self.headings: List[Tuple[int, str]] = []
+
+    def enter(self, level: int, title: str):
+        while self.headings and self.headings[-1][0] >= level:
+            self.headings.pop()
+        self.headings.append((level, title))
+
+    @property
+    def path(self) -> str:
+        return " > ".join(title for _, title in self.headings)
+
+    @property
+    def city(self) -> str:
+        for _, title in reversed(self.headings):
+            match = _CITY_HEADING.match(title)
+            if match:
+                return normalize_city(match.group(1))
+        return ""
+
+
+def chunk_lines(lines: Iterable[str], source: str = "",
+                target_tokens: int = CHUNK_TARGET_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                min_tokens: int = CHUNK_MIN_TOKENS) -> Iterator[Chunk]:
+    """
+    结构感知切分：同一小节内按段落/列表项累积到目标长度（正文 token 数）后输出，
+    相邻块保留末尾若干单元作为重叠；块文本以标题路径开头，
+    并带 source / city / section 及 topic_<主题> 元数据。
+    """
+    section = _Section()
+    units: List[Tuple[str, int]] = []   # 当前块的 (文本, token 数)
+    carried = 0                          # units 开头来自上一块重叠的单元个数
+    pending: Optional[Tuple[List[Tuple[str, int]], str, str]] = None  # 尚未输出的上一块
+
+    def render(chunk_units, path, city) -> Chunk:
+        body = "\n".join(text for text, _ in chunk_units)
+        text = f"{path}\n{body}" if path else body
+        metadata = {"source": source, "city": city, "section": path}
+        metadata.update({f"topic_{topic}": True for topic in detect_topics(text)})
+        return Chunk(text, metadata)
+
+    def flush(section_end: bool) -> Iterator[Chunk]:
+        nonlocal units, carried, pending
+        fresh = units[carried:]
+        if not fresh:
+            units, carried = [], 0
+            return
+        fresh_tokens = sum(t for _, t in fresh)
+        # 小节末尾的碎片并入同一小节的上一块
+        if (section_end and pending and pending[1] == section.path and fresh_tokens < min_tokens
+                and sum(t for _, t in pending[0]) + fresh_tokens <= target_tokens + min_tokens):
+            pending[0].extend(fresh)
+            units, carried = [], 0
+            return
+        if pending:
+            yield render(*pending)
+        pending = (list(units), section.path, section.city)
+        if section_end:
+            units, carried = [], 0
+            return
+        # 保留尾部单元作为下一块的重叠
+        tail, tail_tokens = [], 0
+        for unit in reversed(units):
+            if tail_tokens + unit[1] > overlap_tokens:
+                break
+            tail.insert(0, unit)
+            tail_tokens += unit[1]
+        if len(tail) == len(units):
+            tail = tail[1:]
+        units, carried = tail, len(tail)
+
+    for kind, value in _iter_blocks(lines):
+        if kind == "heading":
+            yield from flush(section_end=True)
+            section.enter(*value)
+            continue
+
+        block = "\n".join(value)
+        block_tokens = estimate_tokens(block)
+        if block_tokens <= target_tokens:
+            pieces = [(block, block_tokens)]
+        else:
+            pieces = []
+            for line in value:
+                for piece in _split_long(line, target_tokens):
+                    pieces.append((piece, estimate_tokens(piece)))
+
+        for piece in pieces:
+            if units[carried:] and sum(t for _, t in units) + piece[1] > target_tokens:
+                yield from flush(section_end=False)
+            units.append(piece)
+
+    yield from flush(section_end=True)
+    if pending:
+        yield render(*pending)
+
+
+def chunk_file(file_path: str, source: Optional[str] = None, **kwargs) -> Iterator[Chunk]:
+    """流式切分知识库文件"""
+    return chunk_lines(iter_lines(file_path), source=source or file_path, **kwargs)
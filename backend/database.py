@@ -1,5 +1,5 @@
 # backend/database.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Boolean, DateTime, JSON, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Boolean, DateTime, JSON, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -56,6 +56,10 @@ class Trip(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+
+    # 行程列表按 (created_at, id) 游标分页
+    __table_args__ = (Index("ix_trips_user_created", "user_id", "created_at", "id"),)
+
     # 关系
     user = relationship("User", back_populates="trips")
     locations = relationship("TripLocation", back_populates="trip", cascade="all, delete-orphan")
@@ -131,9 +135,59 @@ class UserPreference(Base):
     # 关系
     user = relationship("User")
 
+# 地理编码缓存模型（高德 geocode 结果持久化，含负缓存）
+class GeocodeCacheEntry(Base):
+    __tablename__ = "geocode_cache"
+
+    address_key = Column(String(200), primary_key=True)  # 归一化后的地址
+    location = Column(String(50))  # "lng,lat"，负缓存时为空
+    city = Column(String(20))
+    found = Column(Boolean, default=True)  # False 表示高德明确查无结果
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# 用户统计物化表：随行程增删改增量维护，仪表盘直接读取
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_trips = Column(Integer, default=0)
+    completed_trips = Column(Integer, default=0)
+    total_spent = Column(Float, default=0.0)  # Σ coalesce(actual_cost, budget)
+    total_budget = Column(Float, default=0.0)  # Σ budget
+    total_days = Column(Integer, default=0)
+    total_people = Column(Integer, default=0)
+    lead_time_sum = Column(Float, default=0.0)  # 提前规划天数
+    lead_time_count = Column(Integer, default=0)
+    cpppd_sum = Column(Float, default=0.0)  # 人均每日花费
+    cpppd_count = Column(Integer, default=0)
+    distance_sum = Column(Float, default=0.0)  # 往返距离 (km)
+    city_counts = Column(JSON, default=dict)  # {目的地: 行程数}
+    tag_counts = Column(JSON, default=dict)  # {标签: 出现次数}
+    month_counts = Column(JSON, default=dict)  # {"YYYY-MM": 行程数}
+    season_counts = Column(JSON, default=dict)  # {季节: 行程数}
+    budget_counts = Column(JSON, default=dict)  # {预算档位: 行程数}
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# 行程计划缓存：热门目的地/参数组合的 AI 计划
+class PlanCacheEntry(Base):
+    __tablename__ = "plan_cache"
+
+    cache_key = Column(String(64), primary_key=True)  # 规范化请求字段的 sha256
+    destination = Column(String(100), index=True)
+    days = Column(Integer)
+    plan = Column(Text, nullable=False)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 # 创建数据库表
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all 不会给已存在的表补建新索引
+    for index in Trip.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
     print("数据库初始化完成")
 
 # 数据库会话依赖
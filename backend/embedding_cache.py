@@ -0,0 +1,207 @@
+# backend/embedding_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+from cache_utils import MISSING, LRUCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(BASE_DIR, "embedding_cache"))
+INITIAL_CAPACITY = 1024
+# 查询文本的嵌入只放进程内 LRU，不落盘
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 2048))
+
+_local = threading.local()
+
+
+@contextmanager
+def persisting():
+    """
+    标记当前线程正在导入知识库：期间 CachedEmbedding 计算的嵌入写入磁盘缓存。
+    其余调用（检索时的查询文本）只进内存 LRU，避免一次性查询撑大磁盘缓存。
+    """
+    previous = getattr(_local, "persist", False)
+    _local.persist = True
+    try:
+        yield
+    finally:
+        _local.persist = previous
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    内容寻址的磁盘嵌入缓存（每个模型一个目录）：
+    - vectors.f32: float32 内存映射矩阵，每行一个向量
+    - index.json:  {"dim": 维度, "rows": 已用行数, "keys": {sha256(文本): 行号}}
+    - index.log:   index.json 之后新增的键，每行 "sha256 行号"，只追加；加载时合并回 index.json
+    """
+
+    def __init__(self, model: str, root: str = EMBEDDING_CACHE_DIR):
+        self.model = model
+        self.directory = os.path.join(root, re.sub(r"[^\w.-]", "_", model))
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.log_path = os.path.join(self.directory, "index.log")
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self.rows = 0
+        self.keys: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.dim = index["dim"]
+            self.rows = index["rows"]
+            self.keys = index["keys"]
+            if os.path.exists(self.log_path):
+                self._replay_log()
+            self._open_matrix()
+        except Exception as e:
+            print(f"嵌入缓存损坏，已重置: {e}")
+            self.dim, self.rows, self.keys, self._matrix = None, 0, {}, None
+
+    def _replay_log(self):
+        """合并追加日志（末尾被中断写了一半的行直接忽略），然后压缩回 index.json"""
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2 or not parts[1].isdigit():
+                    continue
+                row = int(parts[1])
+                self.keys[parts[0]] = row
+                self.rows = max(self.rows, row + 1)
+        self._save_index()
+
+    def _open_matrix(self):
+        capacity = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _ensure_capacity(self, needed_rows: int):
+        capacity = self._matrix.shape[0] if self._matrix is not None else 0
+        if needed_rows <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity * 2)
+        while new_capacity < needed_rows:
+            new_capacity *= 2
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._open_matrix()
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim, "rows": self.rows, "keys": self.keys}, f)
+        os.replace(tmp_path, self.index_path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+    def _append_index(self, entries: List[tuple]):
+        """新增的键追加到日志；向量已先行写入并 flush，日志里的行号总是有效的"""
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{digest} {row}\n" for digest, row in entries))
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """按文本查缓存，未命中的位置为 None"""
+        with self._lock:
+            results = []
+            for text in texts:
+                row = self.keys.get(text_digest(text))
+                if row is None or self._matrix is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.array(self._matrix[row]))
+            return results
+
+    def put_many(self, texts: List[str], vectors) -> None:
+        """写入新向量（已存在的文本跳过），新键追加到索引日志"""
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(matrix.shape[1])
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {matrix.shape[1]} 与缓存维度 {self.dim} 不一致")
+
+            new_rows, new_keys = [], []
+            for text, vector in zip(texts, matrix):
+                digest = text_digest(text)
+                if digest not in self.keys:
+                    self.keys[digest] = self.rows + len(new_rows)
+                    new_keys.append((digest, self.keys[digest]))
+                    new_rows.append(vector)
+            if not new_rows:
+                return
+            self._ensure_capacity(self.rows + len(new_rows))
+            self._matrix[self.rows:self.rows + len(new_rows)] = np.stack(new_rows)
+            self._matrix.flush()
+            self.rows += len(new_rows)
+            if os.path.exists(self.index_path):
+                self._append_index(new_keys)
+            else:
+                # 首次写入：建立带维度信息的 index.json
+                self._save_index()
+
+    def stats(self) -> Dict[str, int]:
+        return {"model": self.model, "entries": self.rows, "hits": self.hits, "misses": self.misses}
+
+
+class CachedEmbedding(EmbeddingFunction):
+    """
+    为任意嵌入函数加上内容寻址缓存：只有新增或修改过的文本才会调用底层模型。
+    导入知识库（persisting() 内）的嵌入写入磁盘缓存；查询文本的嵌入只进内存 LRU。
+    """
+
+    def __init__(self, inner: EmbeddingFunction, model: str, root: str = EMBEDDING_CACHE_DIR,
+                 query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.inner = inner
+        self.cache = EmbeddingCache(model, root)
+        self.query_cache = LRUCache(maxsize=query_cache_size)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        persist = getattr(_local, "persist", False)
+        cached = self.cache.get_many(texts)
+        if not persist:
+            for i, vector in enumerate(cached):
+                if vector is None:
+                    vector = self.query_cache.get(texts[i])
+                    cached[i] = None if vector is MISSING else vector
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            # 同一批内重复的文本只嵌入一次
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = self.inner(unique_texts)
+            if persist:
+                self.cache.put_many(unique_texts, fresh)
+            else:
+                for text, vector in zip(unique_texts, fresh):
+                    self.query_cache.set(text, np.asarray(vector, dtype=np.float32))
+            fresh_by_text = dict(zip(unique_texts, fresh))
+            for i in missing:
+                cached[i] = fresh_by_text[texts[i]]
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in cached]
@@ -0,0 +1,145 @@
+# backend/geo_cache.py
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from cache_utils import LRUCache, MISSING
+from database import SessionLocal, GeocodeCacheEntry
+
+# 正向结果缓存 30 天，查无结果的负缓存 1 小时
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", 3600))
+GEOCODE_MEMORY_SIZE = int(os.getenv("GEOCODE_MEMORY_SIZE", 2048))
+# 每写入多少次顺带清理一次过期行
+EVICT_EVERY_WRITES = 200
+
+
+def normalize_address(address: str) -> str:
+    """地址归一化：全角转半角、去首尾空白、合并空白、小写"""
+    text = unicodedata.normalize("NFKC", address or "")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.lower()
+
+
+class GeocodeCache:
+    """两级地理编码缓存：进程内 LRU + SQLite 表 (geocode_cache)"""
+
+    def __init__(self, maxsize: int = GEOCODE_MEMORY_SIZE,
+                 ttl: int = GEOCODE_CACHE_TTL, negative_ttl: int = GEOCODE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, address: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """返回 (是否命中, 结果)；命中负缓存时结果为 None"""
+        key = normalize_address(address)
+        if not key:
+            return False, None
+
+        value = self._memory.get(key)
+        if value is not MISSING:
+            self._count_hit("memory", value)
+            return True, value
+
+        db = SessionLocal()
+        try:
+            entry = db.query(GeocodeCacheEntry).filter(
+                GeocodeCacheEntry.address_key == key
+            ).first()
+            if entry and entry.expires_at > datetime.utcnow():
+                value = {"location": entry.location, "city": entry.city or ""} if entry.found else None
+                # 回填内存层，剩余寿命与数据库保持一致
+                remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+                self._memory.set(key, value, ttl=max(1, remaining))
+                self._count_hit("db", value)
+                return True, value
+        except Exception as e:
+            print(f"Geocode Cache Read Error: {e}")
+        finally:
+            db.close()
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, address: str, value: Optional[Dict[str, Any]]):
+        """写入缓存；value 为 None 表示负缓存（高德明确查无结果）"""
+        key = normalize_address(address)
+        if not key:
+            return
+        ttl = self.ttl if value else self.negative_ttl
+        self._memory.set(key, value, ttl=ttl)
+
+        db = SessionLocal()
+        try:
+            db.merge(GeocodeCacheEntry(
+                address_key=key,
+                location=value["location"] if value else None,
+                city=value.get("city", "") if value else None,
+                found=bool(value),
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Geocode Cache Write Error: {e}")
+        finally:
+            db.close()
+
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY_WRITES == 0
+        if should_evict:
+            self.evict_expired()
+
+    def evict_expired(self) -> int:
+        """删除数据库中已过期的缓存行"""
+        db = SessionLocal()
+        try:
+            deleted = db.query(GeocodeCacheEntry).filter(
+                GeocodeCacheEntry.expires_at <= datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            print(f"Geocode Cache Evict Error: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def _count_hit(self, tier: str, value):
+        with self._lock:
+            if tier == "memory":
+                self.memory_hits += 1
+            else:
+                self.db_hits += 1
+            if value is None:
+                self.negative_hits += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计；saved_calls 即节省的高德 API 调用次数"""
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "saved_calls": hits,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "memory": self._memory.stats()
+        }
+
+
+geocode_cache = GeocodeCache()
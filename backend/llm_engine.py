@@ -1,15 +1,88 @@
 import os
 import json
+import asyncio
+import functools
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 import dashscope
 from dotenv import load_dotenv
 from tools.amap_tool import search_poi, search_nearby
 from rag_engine import search_knowledge
+from chunker import TOPIC_KEYWORDS
+from plan_cache import plan_cache, plan_cache_key
+from singleflight import SingleFlight
+from semantic_cache import chat_cache
 
 load_dotenv()
 
 dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
 
+# DashScope SDK 是同步的：放到专用的有界线程池中执行，避免阻塞事件循环，
+# 同时限制同时在途的大模型请求数量
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", 8))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+PLAN_LLM_TIMEOUT = float(os.getenv("PLAN_LLM_TIMEOUT", 120))
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="dashscope")
+
+async def _generation_call(timeout=LLM_TIMEOUT, **kwargs):
+    """
+    异步调用 dashscope.Generation.call，超时抛出 asyncio.TimeoutError。
+    被取消（如客户端断开）时协程立即返回，后台线程完成后其结果被丢弃。
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_llm_executor, functools.partial(dashscope.Generation.call, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+# 流式输出：生产线程与消费协程之间的有界队列长度（队列满时生产线程阻塞，形成背压）
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 64))
+# 流式输出两个分片之间允许的最大间隔（秒）
+STREAM_CHUNK_TIMEOUT = float(os.getenv("STREAM_CHUNK_TIMEOUT", 30))
+_STREAM_END = object()
+
+async def _iterate_in_thread(make_iterator, maxsize=STREAM_QUEUE_SIZE, chunk_timeout=STREAM_CHUNK_TIMEOUT):
+    """
+    在 LLM 线程池中消费同步迭代器（如 DashScope 流式响应），以异步生成器的形式逐个产出。
+    消费方停止迭代（客户端断开、超时）时通知生产线程尽快退出。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # 队列满时阻塞生产线程，直到消费方取走数据或放弃
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        try:
+            for item in make_iterator():
+                if stop.is_set():
+                    return
+                put(item)
+            if not stop.is_set():
+                put(_STREAM_END)
+        except Exception as e:
+            if not stop.is_set():
+                put(e)
+
+    producer = loop.run_in_executor(_llm_executor, produce)
+    try:
+        while True:
+            item = await asyncio.wait_for(queue.get(), chunk_timeout)
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # 清空队列，释放可能阻塞在 put 上的生产线程
+        while not queue.empty():
+            queue.get_nowait()
+        if producer.done() and not producer.cancelled():
+            producer.exception()
+
 # Define available tools for the LLM
 TOOLS_SCHEMA = [
     {
@@ -51,7 +124,9 @@ TOOLS_SCHEMA = [
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "query": {"type": "string", "description": "The semantic search query (e.g., 'Beijing scams', 'Hangzhou hidden spots')."}
+                    "query": {"type": "string", "description": "The semantic search query (e.g., 'Beijing scams', 'Hangzhou hidden spots')."},
+                    "city": {"type": "string", "description": "Optional. Restrict results to one city, in Chinese (e.g., '杭州')."},
+                    "topic": {"type": "string", "enum": list(TOPIC_KEYWORDS), "description": "Optional. Restrict results to one topic."}
                 },
                 "required": ["query"]
             }
@@ -67,21 +142,129 @@ def _get_tool_call_info(tool_call):
     else:
         # Assume it's an object
         return tool_call.function.name, tool_call.function.arguments, tool_call.id
-async def generate_full_plan(origin, destination, days, people, preferences="无特殊偏好", budget="适中", transport="公共交通", pace="适中", who_with="朋友", tags=[], api_config={}):
+# 单轮工具调用的总时限（秒），超时未完成的工具记为失败
+TOOL_TURN_DEADLINE = float(os.getenv("TOOL_TURN_DEADLINE", 15))
+
+async def _execute_tool(func_name, func_args_str, amap_key):
+    """执行单个工具调用，返回可序列化为 JSON 的结果"""
+    try:
+        function_args = json.loads(func_args_str) if func_args_str else {}
+    except json.JSONDecodeError as e:
+        print(f"解析参数失败: {e}")
+        function_args = {}
+
+    print(f"执行工具: {func_name}，参数: {function_args}")
+
+    try:
+        if func_name == 'search_poi':
+            if not amap_key:
+                return {"error": "未配置高德地图 API Key"}
+            function_args['api_key'] = amap_key
+            pois = await search_poi(**function_args)
+            if pois:
+                return {
+                    "success": True,
+                    "count": len(pois),
+                    "pois": pois[:3],  # 只返回前3个
+                    "summary": f"找到{len(pois)}个相关地点"
+                }
+            return {"error": "搜索失败"}
+
+        elif func_name == 'search_nearby':
+            if not amap_key:
+                return {"error": "未配置高德地图 API Key"}
+            function_args['api_key'] = amap_key
+            pois = await search_nearby(**function_args)
+            if pois:
+                return {
+                    "success": True,
+                    "count": len(pois),
+                    "pois": pois[:5],  # 只返回前5个
+                    "summary": f"找到{len(pois)}个附近设施"
+                }
+            return {"error": "搜索失败"}
+
+        elif func_name == 'search_knowledge_base':
+            # 同步的向量检索放到线程池，避免阻塞事件循环
+            result = await asyncio.to_thread(search_knowledge, **function_args)
+            if result:
+                return {
+                    "success": True,
+                    "documents": result[:3],  # 只返回前3个文档
+                    "summary": f"找到{len(result)}条相关建议"
+                }
+            return {"error": "知识库中未找到相关信息"}
+
+        return {"error": f"未知工具: {func_name}"}
+
+    except Exception as e:
+        print(f"工具执行错误: {e}")
+        return {"error": f"工具执行异常: {str(e)}"}
+
+async def _run_tool_calls(tool_calls, amap_key, on_event=None):
     """
-    生成全面的旅行计划文档。
+    并发执行本轮的所有工具调用（受 TOOL_TURN_DEADLINE 限制）。
+    返回结果列表，顺序与 tool_calls 一致。
+    on_event: 可选回调，在每个工具开始/结束时收到进度事件字典。
     """
-    # 配置 DashScope Key
-    dashscope.api_key = "sk-6c96e1a36e9a4f00ad691535210d7e0e"
+    async def tracked(index, func_name, func_args_str):
+        if on_event:
+            on_event({"type": "tool_start", "index": index, "name": func_name})
+        result = await _execute_tool(func_name, func_args_str, amap_key)
+        if on_event:
+            on_event({
+                "type": "tool_end", "index": index, "name": func_name,
+                "success": bool(result.get("success")),
+                "summary": result.get("summary") or result.get("error", "")
+            })
+        return result
+
+    tasks = []
+    for i, tool_call in enumerate(tool_calls):
+        func_name, func_args_str, _ = _get_tool_call_info(tool_call)
+        tasks.append(asyncio.ensure_future(tracked(i, func_name, func_args_str)))
+
+    done, pending = await asyncio.wait(tasks, timeout=TOOL_TURN_DEADLINE)
+    for i, task in enumerate(tasks):
+        if task in pending:
+            task.cancel()
+            if on_event:
+                func_name, _, _ = _get_tool_call_info(tool_calls[i])
+                on_event({"type": "tool_end", "index": i, "name": func_name,
+                          "success": False, "summary": "工具执行超时"})
+    if pending:
+        print(f"{len(pending)} 个工具调用超时（{TOOL_TURN_DEADLINE}s），已取消")
 
+    return [
+        task.result() if task in done else {"error": "工具执行超时"}
+        for task in tasks
+    ]
+
+def _plan_fields(origin, destination, days, people, preferences, budget, transport, pace, who_with, tags):
+    """计划缓存键使用的请求字段"""
+    return {
+        "origin": origin, "destination": destination, "days": days, "people": people,
+        "preferences": preferences, "budget": budget, "transport": transport,
+        "pace": pace, "who_with": who_with, "tags": tags,
+    }
+
+async def _build_plan_messages(origin, destination, days, people, preferences, budget, transport, pace, who_with, tags):
+    """
+    组装行程生成的提示词（含 RAG 上下文）。
+    返回 (messages, rag_context, tags_str)。
+    """
     # 获取 RAG 上下文来增强计划
     rag_context = ""
     try:
         print(f"为 {destination} 搜索知识库...")
-        rag_docs = search_knowledge(f"{destination} 旅游 攻略 避坑")
+        query = f"{destination} 旅游 攻略 避坑"
+        rag_docs = await asyncio.to_thread(search_knowledge, query, city=destination)
+        if not rag_docs:
+            # 知识库里没有该城市的内容时退回不过滤的检索，保留通用建议
+            rag_docs = await asyncio.to_thread(search_knowledge, query)
         if rag_docs:
             print(f"找到 {len(rag_docs)} 条相关知识")
-            rag_context = "\n\n**参考的独家知识库信息**:\n" + "\n".join([f"- {doc[:200]}..." for doc in rag_docs])
+            rag_context = "\n\n**参考的独家知识库信息**:\n" + "\n".join([f"- {doc}" for doc in rag_docs])
         else:
             print(f"未找到 {destination} 的相关知识")
     except Exception as e:
@@ -133,18 +316,11 @@ async def generate_full_plan(origin, destination, days, people, preferences="无
         {'role': 'user', 'content': '请开始生成攻略。'}
     ]
 
-    try:
-        response = dashscope.Generation.call(
-            model='qwen-max',
-            messages=messages,
-            result_format='message',
-        )
-        if response.status_code == HTTPStatus.OK:
-            return response.output.choices[0].message.content
-        else:
-            print(f"LLM 调用失败: {response.code} - {response.message}")
-            # 返回一个基础版本
-            return f"""# {destination} {days}日游攻略
+    return messages, rag_context, tags_str
+
+def _basic_plan(destination, days, people, budget, tags_str, rag_context):
+    """LLM 不可用时返回的基础版攻略"""
+    return f"""# {destination} {days}日游攻略
 
 ##  基本信息
 - **目的地**: {destination}
@@ -165,33 +341,114 @@ async def generate_full_plan(origin, destination, days, people, preferences="无
 - **总计**: ¥{750 * days * people}
 
  提示：在系统设置中配置您的 DashScope API Key 以获得 AI 生成的详细行程。"""
+
+# 相同参数的并发计划生成只调用一次大模型
+plan_flight = SingleFlight()
+
+async def generate_full_plan(origin, destination, days, people, preferences="无特殊偏好", budget="适中", transport="公共交通", pace="适中", who_with="朋友", tags=[], api_config={}):
+    """
+    生成全面的旅行计划文档。
+    与计划缓存使用同一个规范化键：同时到达的相同请求共享一次生成结果。
+    合并键里带上所用 Key 的指纹：只在同一个 Key 的请求之间共享，不会拿 A 的 Key 为 B 计费，
+    也不会把无 Key 时的兜底计划或某个 Key 的报错结果发给其他用户。
+    """
+    api_key, _ = _resolve_keys(api_config)
+    key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else ""
+    key = (plan_cache_key(_plan_fields(
+        origin, destination, days, people, preferences, budget, transport, pace, who_with, tags
+    )), key_id)
+    return await plan_flight.do(key, lambda: _generate_full_plan(
+        origin, destination, days, people, preferences, budget, transport, pace, who_with, tags, api_config
+    ))
+
+async def _generate_full_plan(origin, destination, days, people, preferences, budget, transport, pace, who_with, tags, api_config):
+    # 本次请求的 Key 只在调用时传入，不修改全局配置
+    api_key, _ = _resolve_keys(api_config)
+
+    messages, rag_context, tags_str = await _build_plan_messages(
+        origin, destination, days, people, preferences, budget, transport, pace, who_with, tags
+    )
+    if not api_key:
+        return _basic_plan(destination, days, people, budget, tags_str, rag_context)
+
+    try:
+        response = await _generation_call(
+            timeout=PLAN_LLM_TIMEOUT,
+            model='qwen-max',
+            messages=messages,
+            result_format='message',
+            api_key=api_key,
+        )
+        if response.status_code == HTTPStatus.OK:
+            plan = response.output.choices[0].message.content
+            # 只缓存大模型成功生成的计划，降级/报错文本不入缓存
+            await asyncio.to_thread(plan_cache.set, _plan_fields(
+                origin, destination, days, people, preferences, budget, transport, pace, who_with, tags
+            ), plan)
+            return plan
+        else:
+            print(f"LLM 调用失败: {response.code} - {response.message}")
+            # 返回一个基础版本
+            return _basic_plan(destination, days, people, budget, tags_str, rag_context)
+    except asyncio.TimeoutError:
+        print(f"生成计划超时（{PLAN_LLM_TIMEOUT}s）")
+        return "生成旅行计划超时，请稍后再试。"
     except Exception as e:
         print(f"生成计划异常: {str(e)}")
         return f"生成旅行计划时出错: {str(e)}"
 
-async def call_qwen_with_tools(messages, api_config={}):
+async def stream_full_plan(origin, destination, days, people, preferences="无特殊偏好", budget="适中", transport="公共交通", pace="适中", who_with="朋友", tags=[], api_config={}):
     """
-    Call Qwen model with tool support.
+    流式生成旅行计划：使用 DashScope 增量输出，逐段产出 Markdown 文本。
+    已产出内容后 LLM 出错时抛出 RuntimeError。
     """
-    # Configure DashScope Key if provided
-    if api_config and api_config.get("dashscope_key"):
-        dashscope.api_key = api_config["dashscope_key"]
-    else:
-        dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
-    
-    amap_key = api_config.get("amap_key") if api_config else os.getenv("AMAP_API_KEY")
-    
-    if not dashscope.api_key:
-        return " 未检测到 DashScope API Key。\n\n要使用完整的AI对话功能，请前往系统设置配置您的API Key。\n\n目前您可以：\n✅ 查看预设旅行建议\n✅ 使用手动规划功能\n✅ 进行预算计算"
-    
-    print(f"调用 LLM，消息数: {len(messages)}")
-    
-    try:
-        # 构建系统消息增强
-        enhanced_messages = []
-        
-        # 添加增强的系统提示
-        enhanced_system = """你是WanderAI，一个专业的旅行规划助手。你可以使用以下工具获取实时信息：
+    # 本次请求的 Key 只在调用时传入，不修改全局配置
+    api_key, _ = _resolve_keys(api_config)
+
+    messages, rag_context, tags_str = await _build_plan_messages(
+        origin, destination, days, people, preferences, budget, transport, pace, who_with, tags
+    )
+    if not api_key:
+        yield _basic_plan(destination, days, people, budget, tags_str, rag_context)
+        return
+
+    def make_stream():
+        return dashscope.Generation.call(
+            model='qwen-max',
+            messages=messages,
+            result_format='message',
+            stream=True,
+            incremental_output=True,
+            api_key=api_key,
+        )
+
+    parts = []
+    async for response in _iterate_in_thread(make_stream):
+        if response.status_code != HTTPStatus.OK:
+            print(f"LLM 流式调用失败: {response.code} - {response.message}")
+            if not parts:
+                # 尚未输出任何内容：整体退回基础计划
+                yield _basic_plan(destination, days, people, budget, tags_str, rag_context)
+                return
+            # 已输出部分计划：不能再拼接一份基础计划，抛出让调用方发送错误事件（不缓存、不落库）
+            raise RuntimeError(f"生成中断: {response.code} - {response.message}")
+        delta = response.output.choices[0].message.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    # 完整生成结束才写入计划缓存（中途断开时生成器被关闭，不会走到这里）
+    if parts:
+        await asyncio.to_thread(plan_cache.set, _plan_fields(
+            origin, destination, days, people, preferences, budget, transport, pace, who_with, tags
+        ), "".join(parts))
+
+NO_API_KEY_REPLY = " 未检测到 DashScope API Key。\n\n要使用完整的AI对话功能，请前往系统设置配置您的API Key。\n\n目前您可以：\n✅ 查看预设旅行建议\n✅ 使用手动规划功能\n✅ 进行预算计算"
+DEFAULT_REPLY = "我可以帮您规划旅行、推荐景点、估算预算。请告诉我您的具体需求！"
+TIMEOUT_REPLY = " 抱歉，AI服务响应超时，请稍后再试。"
+LLM_ERROR_PREFIX = " 抱歉，AI服务暂时遇到问题。"
+
+ENHANCED_SYSTEM_PROMPT = """你是WanderAI，一个专业的旅行规划助手。你可以使用以下工具获取实时信息：
 
 可用工具：
 1. search_poi - 搜索地点（如：故宫、西湖、外滩）
@@ -209,206 +466,268 @@ async def call_qwen_with_tools(messages, api_config={}):
 - 使用emoji增强表达
 - 提供具体、可行的建议
 - 根据上下文保持对话连贯性"""
-        
-        # 查找现有系统消息
-        has_system_msg = False
-        for msg in messages:
-            if msg.get("role") == "system":
-                # 合并系统消息
-                enhanced_messages.append({
-                    "role": "system",
-                    "content": enhanced_system + "\n\n" + msg.get("content", "")
-                })
-                has_system_msg = True
-            else:
-                enhanced_messages.append(msg)
-        
-        if not has_system_msg:
-            enhanced_messages.insert(0, {
+
+def _resolve_keys(api_config):
+    """确定本次请求使用的 DashScope / 高德 Key"""
+    # 请求自带的 Key 优先，否则用环境变量；不写 dashscope.api_key，避免并发请求之间互相覆盖全局配置
+    api_key = (api_config or {}).get("dashscope_key") or os.getenv("DASHSCOPE_API_KEY")
+    amap_key = api_config.get("amap_key") if api_config else os.getenv("AMAP_API_KEY")
+    return api_key, amap_key
+
+def _enhance_messages(messages):
+    """合并/插入增强的系统提示"""
+    enhanced_messages = []
+
+    # 查找现有系统消息
+    has_system_msg = False
+    for msg in messages:
+        if msg.get("role") == "system":
+            # 合并系统消息
+            enhanced_messages.append({
                 "role": "system",
-                "content": enhanced_system
+                "content": ENHANCED_SYSTEM_PROMPT + "\n\n" + msg.get("content", "")
             })
-        
-        response = dashscope.Generation.call(
-            model='qwen-turbo',  # 使用 turbo 模型降低成本
-            messages=enhanced_messages,
-            tools=TOOLS_SCHEMA,
-            result_format='message',
-        )
-        
-        if response.status_code != HTTPStatus.OK:
-            print(f"LLM 调用失败: {response.code} - {response.message}")
-            raise Exception(f"AI服务错误: {response.message}")
-        
-        output = response.output.choices[0].message
-        
-        # 安全地检查 tool_calls
-        content = ""
-        tool_calls = []
-        
+            has_system_msg = True
+        else:
+            enhanced_messages.append(msg)
+
+    if not has_system_msg:
+        enhanced_messages.insert(0, {
+            "role": "system",
+            "content": ENHANCED_SYSTEM_PROMPT
+        })
+    return enhanced_messages
+
+def _parse_output(output):
+    """安全地从模型输出中取出 (content, tool_calls)"""
+    content = ""
+    tool_calls = []
+
+    try:
+        # 方法1：尝试转换为字典
+        if hasattr(output, '__dict__'):
+            output_dict = output.__dict__
+        elif hasattr(output, 'to_dict'):
+            output_dict = output.to_dict()
+        else:
+            output_dict = dict(output) if hasattr(output, '__iter__') else {}
+
+        # 检查字典中是否有 tool_calls
+        if 'tool_calls' in output_dict:
+            tool_calls = output_dict.get('tool_calls', [])
+            content = output_dict.get('content', '')
+        else:
+            # 如果没有 tool_calls 键，尝试其他方式
+            content = getattr(output, 'content', '') if hasattr(output, 'content') else ''
+
+    except Exception as dict_error:
+        print(f"转换输出为字典失败: {dict_error}")
+        # 尝试直接获取
         try:
-            # 方法1：尝试转换为字典
-            if hasattr(output, '__dict__'):
-                output_dict = output.__dict__
-            elif hasattr(output, 'to_dict'):
-                output_dict = output.to_dict()
-            else:
-                output_dict = dict(output) if hasattr(output, '__iter__') else {}
-            
-            # 检查字典中是否有 tool_calls
-            if 'tool_calls' in output_dict:
-                tool_calls = output_dict.get('tool_calls', [])
-                content = output_dict.get('content', '')
-            else:
-                # 如果没有 tool_calls 键，尝试其他方式
-                content = getattr(output, 'content', '') if hasattr(output, 'content') else ''
-                
-        except Exception as dict_error:
-            print(f"转换输出为字典失败: {dict_error}")
-            # 尝试直接获取
-            try:
-                content = output.content
-            except:
-                content = ""
+            content = output.content
+        except:
+            content = ""
+    return content, tool_calls or []
+
+def _tool_calls_for_history(tool_calls):
+    """将 tool_calls 规范化为写回对话历史的格式"""
+    history = []
+    for i, tc in enumerate(tool_calls):
+        if isinstance(tc, dict):
+            history.append({
+                "id": tc.get('id', f"call_{i}"),
+                "type": "function",
+                "function": {
+                    "name": tc.get('function', {}).get('name', ''),
+                    "arguments": tc.get('function', {}).get('arguments', '')
+                }
+            })
+        else:
+            # 如果是对象
+            history.append({
+                "id": getattr(tc, 'id', f"call_{i}"),
+                "type": "function",
+                "function": {
+                    "name": getattr(tc.function, 'name', ''),
+                    "arguments": getattr(tc.function, 'arguments', '')
+                }
+            })
+    return history
+
+def _append_tool_round(enhanced_messages, content, tool_calls, tool_results):
+    """把助手的工具调用与工具结果（按 tool_call 顺序）追加到对话历史"""
+    tool_calls_for_history = _tool_calls_for_history(tool_calls)
+    enhanced_messages.append({
+        "role": "assistant",
+        "content": content or "正在为您查询信息...",
+        "tool_calls": tool_calls_for_history
+    })
+    for i, tool_result in enumerate(tool_results):
+        enhanced_messages.append({
+            "role": "tool",
+            "content": json.dumps(tool_result, ensure_ascii=False),
+            "tool_call_id": tool_calls_for_history[i]["id"] or f"call_{i}"
+        })
+
+def _summarize_tool_results(tool_results):
+    """总结调用失败时，直接拼接工具结果"""
+    summary = "已为您查询到以下信息：\n\n"
+    for i, result in enumerate(tool_results):
+        if result.get('success'):
+            if 'summary' in result:
+                summary += f"{i+1}. {result['summary']}\n"
+            if 'pois' in result:
+                for poi in result['pois'][:2]:
+                    summary += f"   • {poi.get('name', '未知')}"
+                    if poi.get('address'):
+                        summary += f" - {poi.get('address')}"
+                    summary += "\n"
+    return summary
+
+async def _first_round(enhanced_messages, api_key):
+    """第一次调用 LLM（带工具定义），返回 (content, tool_calls)"""
+    response = await _generation_call(
+        model='qwen-turbo',  # 使用 turbo 模型降低成本
+        messages=enhanced_messages,
+        tools=TOOLS_SCHEMA,
+        result_format='message',
+        api_key=api_key,
+    )
+
+    if response.status_code != HTTPStatus.OK:
+        print(f"LLM 调用失败: {response.code} - {response.message}")
+        raise Exception(f"AI服务错误: {response.message}")
+
+    return _parse_output(response.output.choices[0].message)
+
+def _llm_error_reply(e):
+    # 返回更友好的错误信息
+    return f"{LLM_ERROR_PREFIX}\n\n错误信息: {str(e)[:100]}\n\n 您可以：\n1. 检查API Key配置\n2. 稍后再试\n3. 使用手动规划功能"
+
+def is_error_reply(reply):
+    """是否为未配置 Key / 超时 / 调用异常时的提示文本（不是模型的回答，不应写入对话记忆）"""
+    return reply in (NO_API_KEY_REPLY, TIMEOUT_REPLY) or reply.startswith(LLM_ERROR_PREFIX)
+
+async def call_qwen_with_tools(messages, api_config={}, cache_query=None):
+    """
+    Call Qwen model with tool support.
+    cache_query: 传入时，成功生成的回答以该问题写入语义缓存（调用方需确认对话不含个人上下文）。
+    """
+    api_key, amap_key = _resolve_keys(api_config)
+    if not api_key:
+        return NO_API_KEY_REPLY
+    
+    print(f"调用 LLM，消息数: {len(messages)}")
+    
+    try:
+        enhanced_messages = _enhance_messages(messages)
+        content, tool_calls = await _first_round(enhanced_messages, api_key)
         
-        if tool_calls and len(tool_calls) > 0:
+        if tool_calls:
             print(f"检测到工具调用: {len(tool_calls)} 个")
             
-            # 添加助手消息到历史
-            tool_calls_for_history = []
-            for i, tc in enumerate(tool_calls):
-                if isinstance(tc, dict):
-                    tool_calls_for_history.append({
-                        "id": tc.get('id', f"call_{i}"),
-                        "type": "function",
-                        "function": {
-                            "name": tc.get('function', {}).get('name', ''),
-                            "arguments": tc.get('function', {}).get('arguments', '')
-                        }
-                    })
-                else:
-                    # 如果是对象
-                    tool_calls_for_history.append({
-                        "id": getattr(tc, 'id', f"call_{i}"),
-                        "type": "function",
-                        "function": {
-                            "name": getattr(tc.function, 'name', ''),
-                            "arguments": getattr(tc.function, 'arguments', '')
-                        }
-                    })
-            
-            enhanced_messages.append({
-                "role": "assistant",
-                "content": content or "正在为您查询信息...",
-                "tool_calls": tool_calls_for_history
-            })
-            
-            # 执行工具调用
-            tool_results = []
-            for i, tool_call in enumerate(tool_calls):
-                func_name, func_args_str, tool_id = _get_tool_call_info(tool_call)
-                
-                try:
-                    function_args = json.loads(func_args_str) if func_args_str else {}
-                except json.JSONDecodeError as e:
-                    print(f"解析参数失败: {e}")
-                    function_args = {}
-                
-                print(f"执行工具: {func_name}，参数: {function_args}")
-                
-                tool_result = {"error": "工具执行失败"}
-                
-                try:
-                    if func_name == 'search_poi':
-                        if amap_key:
-                            function_args['api_key'] = amap_key
-                            result = await search_poi(**function_args)
-                            if result and not result.get('error'):
-                                tool_result = {
-                                    "success": True,
-                                    "count": len(result.get('pois', [])),
-                                    "pois": result.get('pois', [])[:3],  # 只返回前3个
-                                    "summary": f"找到{len(result.get('pois', []))}个相关地点"
-                                }
-                            else:
-                                tool_result = {"error": result.get('error', '搜索失败')}
-                        else:
-                            tool_result = {"error": "未配置高德地图 API Key"}
-                    
-                    elif func_name == 'search_nearby':
-                        if amap_key:
-                            function_args['api_key'] = amap_key
-                            result = await search_nearby(**function_args)
-                            if result and not result.get('error'):
-                                tool_result = {
-                                    "success": True,
-                                    "count": len(result.get('pois', [])),
-                                    "pois": result.get('pois', [])[:5],  # 只返回前5个
-                                    "summary": f"找到{len(result.get('pois', []))}个附近设施"
-                                }
-                            else:
-                                tool_result = {"error": result.get('error', '搜索失败')}
-                        else:
-                            tool_result = {"error": "未配置高德地图 API Key"}
-                    
-                    elif func_name == 'search_knowledge_base':
-                        result = search_knowledge(**function_args)
-                        if result:
-                            tool_result = {
-                                "success": True,
-                                "documents": result[:3],  # 只返回前3个文档
-                                "summary": f"找到{len(result)}条相关建议"
-                            }
-                        else:
-                            tool_result = {"error": "知识库中未找到相关信息"}
-                    
-                except Exception as e:
-                    print(f"工具执行错误: {e}")
-                    tool_result = {"error": f"工具执行异常: {str(e)}"}
-                
-                tool_results.append(tool_result)
-                
-                # 添加工具结果到历史
-                enhanced_messages.append({
-                    "role": "tool",
-                    "content": json.dumps(tool_result, ensure_ascii=False),
-                    "tool_call_id": tool_id or f"call_{i}"
-                })
+            # 并发执行工具调用，结果按 tool_call 顺序回填
+            tool_results = await _run_tool_calls(tool_calls, amap_key)
+            _append_tool_round(enhanced_messages, content, tool_calls, tool_results)
             
             # 第二次调用 LLM 总结结果
             print("第二次调用 LLM 总结工具结果")
-            final_response = dashscope.Generation.call(
+            final_response = await _generation_call(
                 model='qwen-turbo',
                 messages=enhanced_messages,
-                result_format='message'
+                result_format='message',
+                api_key=api_key,
             )
             
             if final_response.status_code == HTTPStatus.OK:
                 reply = final_response.output.choices[0].message.content
-                # 标记包含工具调用
+                if cache_query:
+                    chat_cache.set(cache_query, reply)
                 return reply
-            else:
-                # 如果总结失败，返回原始结果
-                summary = "已为您查询到以下信息：\n\n"
-                for i, result in enumerate(tool_results):
-                    if result.get('success'):
-                        if 'summary' in result:
-                            summary += f"{i+1}. {result['summary']}\n"
-                        if 'pois' in result:
-                            for poi in result['pois'][:2]:
-                                summary += f"   • {poi.get('name', '未知')}"
-                                if poi.get('address'):
-                                    summary += f" - {poi.get('address')}"
-                                summary += "\n"
-                return summary
+            # 如果总结失败，返回原始结果
+            return _summarize_tool_results(tool_results)
         
-        else:
-            # 没有工具调用，直接返回内容
-            return content if content else "我可以帮您规划旅行、推荐景点、估算预算。请告诉我您的具体需求！"
+        # 没有工具调用，直接返回内容
+        if content and cache_query:
+            chat_cache.set(cache_query, content)
+        return content if content else DEFAULT_REPLY
             
+    except asyncio.TimeoutError:
+        print(f"LLM 调用超时（{LLM_TIMEOUT}s）")
+        return TIMEOUT_REPLY
     except Exception as e:
         print(f"LLM 调用异常: {str(e)}")
         import traceback
         traceback.print_exc()
-        # 返回更友好的错误信息
-        return f" 抱歉，AI服务暂时遇到问题。\n\n错误信息: {str(e)[:100]}\n\n 您可以：\n1. 检查API Key配置\n2. 稍后再试\n3. 使用手动规划功能"
+        return _llm_error_reply(e)
+
+async def stream_qwen_with_tools(messages, api_config={}):
+    """
+    流式版本的 call_qwen_with_tools，逐步产出事件字典：
+    - {"type": "tool_start", "index", "name"}  工具开始执行
+    - {"type": "tool_end", "index", "name", "success", "summary"}  工具执行完毕
+    - {"type": "delta", "text"}  回复文本增量（第二次总结调用为流式输出）
+    """
+    api_key, amap_key = _resolve_keys(api_config)
+    if not api_key:
+        yield {"type": "delta", "text": NO_API_KEY_REPLY}
+        return
+
+    enhanced_messages = _enhance_messages(messages)
+    try:
+        content, tool_calls = await _first_round(enhanced_messages, api_key)
+    except asyncio.TimeoutError:
+        yield {"type": "delta", "text": TIMEOUT_REPLY}
+        return
+    except Exception as e:
+        print(f"LLM 调用异常: {str(e)}")
+        yield {"type": "delta", "text": _llm_error_reply(e)}
+        return
+
+    if not tool_calls:
+        yield {"type": "delta", "text": content if content else DEFAULT_REPLY}
+        return
+
+    # 工具并发执行，进度事件经队列转发给调用方
+    events = asyncio.Queue()
+    runner = asyncio.ensure_future(_run_tool_calls(tool_calls, amap_key, on_event=events.put_nowait))
+    try:
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({getter, runner}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            while not events.empty():
+                yield events.get_nowait()
+            break
+        tool_results = runner.result()
+    finally:
+        if not runner.done():
+            runner.cancel()
+
+    _append_tool_round(enhanced_messages, content, tool_calls, tool_results)
+
+    def make_stream():
+        return dashscope.Generation.call(
+            model='qwen-turbo',
+            messages=enhanced_messages,
+            result_format='message',
+            stream=True,
+            incremental_output=True,
+            api_key=api_key,
+        )
+
+    stream = _iterate_in_thread(make_stream)
+    try:
+        async for response in stream:
+            if response.status_code != HTTPStatus.OK:
+                print(f"LLM 流式调用失败: {response.code} - {response.message}")
+                yield {"type": "delta", "text": _summarize_tool_results(tool_results)}
+                return
+            delta = response.output.choices[0].message.content
+            if delta:
+                yield {"type": "delta", "text": delta}
+    finally:
+        await stream.aclose()
@@ -0,0 +1,85 @@
+# backend/local_embedding.py
+import re
+import unicodedata
+from typing import Dict, List
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+# 各阶 n-gram 的权重：单字区分度低，双字/三字词更能代表中文地名与短语
+DEFAULT_NGRAM_WEIGHTS = {1: 0.5, 2: 1.0, 3: 1.0}
+_POLY = np.uint64(0x100000001B3)
+_MIX1 = np.uint64(0xFF51AFD7ED558CCD)
+_MIX2 = np.uint64(0xC4CEB9FE1A85EC53)
+_SPACE = 32
+
+
+def normalize_text(text: str) -> str:
+    """全角转半角、小写，标点与空白统一为单个空格"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"[^\w]+", " ", text).strip()
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """64 位哈希终结混合（murmur3 fmix64），保证分桶均匀"""
+    h = h ^ (h >> np.uint64(33))
+    h = h * _MIX1
+    h = h ^ (h >> np.uint64(33))
+    h = h * _MIX2
+    return h ^ (h >> np.uint64(33))
+
+
+class HashingNgramEmbedding(EmbeddingFunction):
+    """
+    本地离线嵌入：字符 n-gram 特征哈希投影到固定维度（带符号哈希减少碰撞偏差），
+    次线性词频缩放后 L2 归一化。纯 NumPy 向量化实现，无需训练、跨重启完全确定。
+    """
+
+    def __init__(self, dim: int = 512, ngram_weights: Dict[int, float] = None):
+        self.dim = dim
+        self.ngram_weights = ngram_weights or DEFAULT_NGRAM_WEIGHTS
+
+    def embed_one(self, text: str) -> np.ndarray:
+        normalized = normalize_text(text)
+        vector = np.zeros(self.dim, dtype=np.float64)
+        if not normalized:
+            return vector.astype(np.float32)
+
+        codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        is_space = codes == _SPACE
+        h = codes.copy()
+        spans_space = is_space.copy()
+        max_n = max(self.ngram_weights)
+        with np.errstate(over="ignore"):
+            for n in range(1, max_n + 1):
+                if n > 1:
+                    if len(h) <= 1:
+                        break
+                    # 滚动多项式哈希：由 (n-1)-gram 推出 n-gram
+                    h = h[:-1] * _POLY + codes[n - 1:]
+                    spans_space = spans_space[:-1] | is_space[n - 1:]
+                weight = self.ngram_weights.get(n)
+                if not weight:
+                    continue
+                valid = ~spans_space
+                if not valid.any():
+                    continue
+                mixed = _mix(h[valid] + np.uint64(n) * _MIX2)
+                buckets = (mixed % np.uint64(self.dim)).astype(np.int64)
+                signs = np.where((mixed >> np.uint64(63)) == 1, -1.0, 1.0)
+                vector += np.bincount(buckets, weights=signs * weight, minlength=self.dim)
+
+        # 次线性缩放，抑制长文本中高频 n-gram 的主导
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.astype(np.float32)
+
+    def embed_many(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed_one(text) for text in texts])
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.embed_many(list(input)).tolist()
@@ -1,26 +1,39 @@
 import math
 from datetime import datetime, timedelta
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query,Body
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query,Body, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, case
+from sqlalchemy import func, desc, case, text, DateTime, select, or_, and_
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
+import base64
 import json
 import os
-import requests
+import random
+import httpx
 from pydantic import BaseModel, Field
 import shutil
 from fastapi.middleware.cors import CORSMiddleware
-from llm_engine import call_qwen_with_tools, generate_full_plan
+from llm_engine import call_qwen_with_tools, stream_qwen_with_tools, generate_full_plan, stream_full_plan, plan_flight, is_error_reply
+from rag_engine import watch_knowledge_base, get_knowledge_status, get_search_cache_stats
 import asyncio
 from database import SessionLocal, init_db, User, Trip, TripLocation, ChatSession, ChatMessage, UserPreference, get_db
+from geo_cache import geocode_cache, normalize_address
+from singleflight import SingleFlight
+from plan_cache import plan_cache
+from schemas import GeneratePlanRequest
+from semantic_cache import chat_cache
+from chat_memory import chat_memory, build_chat_messages
+from user_stats import get_user_stats, stats_to_dict, top_counts
+from analytics import build_stats_details
+from tools.amap_tool import init_client as init_amap_tool_client, close_client as close_amap_tool_client
 from auth import (
     get_password_hash, verify_password, create_access_token,
-    ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_current_active_user
+    ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_current_active_user, get_optional_user
 )
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 # 初始化数据库
 init_db()
 
@@ -44,52 +57,124 @@ app.add_middleware(
     expose_headers=["*"],  # 暴露所有头部
 )
 
+# 高德 Web 服务调用配置
+AMAP_TIMEOUT = float(os.getenv("AMAP_TIMEOUT", 5))
+AMAP_MAX_CONCURRENCY = int(os.getenv("AMAP_MAX_CONCURRENCY", 20))
+AMAP_MAX_RETRIES = int(os.getenv("AMAP_MAX_RETRIES", 2))
+AMAP_BACKOFF_BASE = float(os.getenv("AMAP_BACKOFF_BASE", 0.2))
+# 高德并发/QPS 超限的 infocode，可重试
+AMAP_RETRY_INFOCODES = {"10019", "10020", "10021", "10022", "10023"}
+
 class MapService:
     def __init__(self):
         self.AMAP_WEB_KEY = "2f7e7f522142f058bd513ad4b102fecc"
         self.BASE_URL = "https://restapi.amap.com/v3"
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(AMAP_MAX_CONCURRENCY)
+        self._flight = SingleFlight()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """共享的长连接客户端（keep-alive 连接池）"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(AMAP_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=AMAP_MAX_CONCURRENCY,
+                    max_keepalive_connections=AMAP_MAX_CONCURRENCY,
+                    keepalive_expiry=30
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
-    def geocode(self, address: str):
-        """地址转坐标 + 获取城市编码"""
+    async def _get_json(self, url: str, params: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """GET 请求高德接口：限制并发，网络错误/5xx/限流时指数退避 + 随机抖动重试"""
+        last_error: Exception = RuntimeError("高德请求失败")
+        for attempt in range(AMAP_MAX_RETRIES + 1):
+            try:
+                async with self._semaphore:
+                    response = await self._get_client().get(url, params=params, timeout=timeout or AMAP_TIMEOUT)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise httpx.HTTPStatusError(
+                        f"HTTP {response.status_code}", request=response.request, response=response
+                    )
+                data = response.json()
+                if data.get("status") != "1" and data.get("infocode") in AMAP_RETRY_INFOCODES:
+                    last_error = RuntimeError(f"高德限流: {data.get('info')}")
+                else:
+                    return data
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                last_error = e
+            if attempt < AMAP_MAX_RETRIES:
+                await asyncio.sleep(random.uniform(0, AMAP_BACKOFF_BASE * (2 ** attempt)))
+        raise last_error
+
+    async def geocode(self, address: str):
+        """地址转坐标 + 获取城市编码（先查两级缓存，并发的相同地址只请求一次）"""
+        # 缓存的 SQLite 读写是同步 I/O，放到线程池执行，避免阻塞事件循环
+        hit, cached = await asyncio.to_thread(geocode_cache.get, address)
+        if hit:
+            return cached
+        return await self._flight.do(("geocode", normalize_address(address)), lambda: self._fetch_geocode(address))
+
+    async def geocode_many(self, addresses: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """批量地理编码：并发请求（总并发受 AMAP_MAX_CONCURRENCY 限制），返回 {地址: 结果或 None}"""
+        addresses = list(dict.fromkeys(addresses))
+        results = await asyncio.gather(*(self.geocode(address) for address in addresses))
+        return dict(zip(addresses, results))
+
+    async def _fetch_geocode(self, address: str):
         try:
             url = f"{self.BASE_URL}/geocode/geo"
             params = {"key": self.AMAP_WEB_KEY, "address": address}
-            res = requests.get(url, params=params).json()
+            res = await self._get_json(url, params)
             if res["status"] == "1" and res["geocodes"]:
                 geo = res["geocodes"][0]
-                return {
+                result = {
                     "location": geo["location"],
                     "city": geo.get("citycode", "") or geo.get("adcode", "")
                 }
+                await asyncio.to_thread(geocode_cache.set, address, result)
+                return result
+            if res["status"] == "1":
+                # 高德明确查无结果，写入负缓存；网络/配额错误不缓存
+                await asyncio.to_thread(geocode_cache.set, address, None)
             return None
         except Exception as e:
             print(f"Geocode Error: {e}")
             return None
 
-    def search_places(self, keyword: str, city: str = "全国"):
+    async def search_places(self, keyword: str, city: str = "全国"):
         try:
             url = f"{self.BASE_URL}/place/text"
             params = {
                 "key": self.AMAP_WEB_KEY, "keywords": keyword, "city": city,
                 "offset": 20, "page": 1, "extensions": "all"
             }
-            res = requests.get(url, params=params).json()
+            res = await self._get_json(url, params)
             if res["status"] == "1" and int(res["count"]) > 0:
                 return res["pois"]
             return []
         except Exception:
             return []
-    def get_weather(self, city_code: str):
-        """获取天气信息 (实况 + 预报)"""
+    async def get_weather(self, city_code: str):
+        """获取天气信息 (实况 + 预报)，并发的相同城市只请求一次"""
+        return await self._flight.do(("weather", city_code), lambda: self._fetch_weather(city_code))
+
+    async def _fetch_weather(self, city_code: str):
         try:
-            # 1. 获取实时天气
+            # 实时天气与预报天气并发请求
             url_live = f"{self.BASE_URL}/weather/weatherInfo"
             params_live = {"key": self.AMAP_WEB_KEY, "city": city_code, "extensions": "base"}
-            res_live = requests.get(url_live, params=params_live).json()
-            
-            # 2. 获取预报天气
             params_forecast = {"key": self.AMAP_WEB_KEY, "city": city_code, "extensions": "all"}
-            res_forecast = requests.get(url_live, params=params_forecast).json()
+            res_live, res_forecast = await asyncio.gather(
+                self._get_json(url_live, params_live),
+                self._get_json(url_live, params_forecast)
+            )
 
             if res_live["status"] == "1" and res_forecast["status"] == "1":
                 live = res_live["lives"][0]
@@ -159,16 +244,17 @@ class MapService:
             "type": "plane" # 标记为飞机
         }
 
-    def calculate_route(self, origin_str: str, dest_str: str, mode: str = "driving"):
+    async def calculate_route(self, origin_str: str, dest_str: str, mode: str = "driving"):
         """
         mode: driving, walking, bicycling, bus(市内公交), train(高铁/火车), plane(飞机)
         """
         try:
             print(f"规划路线: {origin_str} -> {dest_str} [{mode}]")
 
-            # 1. 获取坐标
-            origin_info = self.geocode(origin_str)
-            dest_info = self.geocode(dest_str)
+            # 1. 获取坐标（起终点并发）
+            origin_info, dest_info = await asyncio.gather(
+                self.geocode(origin_str), self.geocode(dest_str)
+            )
 
             if not origin_info or not dest_info:
                 return {"success": False, "msg": "无法定位起点或终点"}
@@ -206,7 +292,7 @@ class MapService:
                 params["strategy"] = 10
 
             # 3. 请求 API
-            res = requests.get(url, params=params).json()
+            res = await self._get_json(url, params, timeout=AMAP_TIMEOUT * 2)
             if res["status"] != "1":
                 return {"success": False, "msg": f"高德API错误: {res.get('info')}"}
 
@@ -267,17 +353,18 @@ class MapService:
         except Exception as e:
             print(f"Route Error: {e}")
             return {"success": False, "msg": str(e)}
-    def get_district_boundary(self, keyword: str):
+    async def get_district_boundary(self, keyword: str):
         try:
             url = f"{self.BASE_URL}/config/district"
             params = {
-                "key": self.AMap_WEB_KEY,
+                "key": self.AMAP_WEB_KEY,
                 "keywords": keyword,
                 "subdistrict": 0,  # 不需要下级行政区
                 "extensions": "all" # 关键：all 才会返回边界坐标 polyline
             }
-            res = requests.get(url, params=params).json()
-            
+            # 边界数据较大，放宽超时
+            res = await self._get_json(url, params, timeout=AMAP_TIMEOUT * 2)
+
             if res["status"] == "1" and res["districts"]:
                 district = res["districts"][0]
                 return {
@@ -303,24 +390,72 @@ class MapService:
 
 map_service = MapService()
 
+@app.on_event("startup")
+async def open_http_clients():
+    # LLM 工具调用复用的高德长连接客户端
+    await init_amap_tool_client()
+
+knowledge_watcher_task = None
+
+@app.on_event("startup")
+async def start_knowledge_ingestion():
+    # 知识库目录同步与变化监听在后台运行，不阻塞服务启动与请求处理
+    global knowledge_watcher_task
+    knowledge_watcher_task = asyncio.create_task(watch_knowledge_base())
+    knowledge_watcher_task.add_done_callback(_log_knowledge_watcher_exit)
+
+def _log_knowledge_watcher_exit(task: asyncio.Task):
+    """后台任务的异常不会自动输出，退出时显式记录，避免静默地继续使用空/旧索引"""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error:
+        import traceback
+        traceback.print_exception(type(error), error, error.__traceback__)
+        print(f"❌ 知识库后台同步任务异常退出: {error}")
+
+@app.on_event("shutdown")
+async def stop_knowledge_watcher():
+    if knowledge_watcher_task:
+        knowledge_watcher_task.cancel()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await map_service.aclose()
+    await close_amap_tool_client()
+
+@app.get("/api/map/geocode-cache/stats")
+async def geocode_cache_stats_api(current_user: User = Depends(get_current_active_user)):
+    """地理编码缓存命中统计（可观察节省的高德调用次数）"""
+    return {"success": True, "stats": geocode_cache.stats()}
+
+@app.get("/api/admin/plan-cache/stats")
+async def plan_cache_stats_api(current_user: User = Depends(get_current_active_user)):
+    """行程计划缓存命中统计"""
+    stats = await asyncio.to_thread(plan_cache.stats)
+    return {"success": True, "stats": stats, "singleflight": plan_flight.stats()}
+
+@app.get("/api/admin/chat-cache/stats")
+async def chat_cache_stats_api(current_user: User = Depends(get_current_active_user)):
+    """聊天语义缓存命中统计"""
+    return {"success": True, "stats": chat_cache.stats()}
+
+@app.get("/api/admin/knowledge/status")
+async def knowledge_status_api(current_user: User = Depends(get_current_active_user)):
+    """知识库导入状态：各文件块数、最近一次导入结果"""
+    status = await asyncio.to_thread(get_knowledge_status)
+    return {"success": True, "status": status}
+
+@app.get("/api/admin/knowledge/search-cache")
+async def knowledge_search_cache_stats_api(current_user: User = Depends(get_current_active_user)):
+    """知识库检索结果缓存命中统计"""
+    return {"success": True, "stats": get_search_cache_stats()}
+
 @app.get("/api/map/boundary")
 async def get_district_boundary_api(keyword: str):
     """获取城市的行政边界"""
-    return map_service.get_district_boundary(keyword)
-
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """计算两点间的大圆距离 (km)"""
-    if not lat1 or not lon1 or not lat2 or not lon2:
-        return 0
-    R = 6371  # 地球半径
-    d_lat = math.radians(lat2 - lat1)
-    d_lon = math.radians(lon2 - lon1)
-    a = (math.sin(d_lat / 2) * math.sin(d_lat / 2) +
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-         math.sin(d_lon / 2) * math.sin(d_lon / 2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+    return await map_service.get_district_boundary(keyword)
+
 
 # 数据模型
 class UserCreate(BaseModel):
@@ -402,6 +537,29 @@ class ChatRequest(BaseModel):
     class Config:
         extra = "ignore"
 
+async def run_until_disconnect(http_request: Request, coro, poll_interval: float = 0.5):
+    """
+    执行耗时协程（如大模型生成），客户端断开连接时取消它，
+    避免为已离开的用户继续占用 LLM 线程池与连接。
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print("客户端已断开，取消生成任务")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="客户端已断开连接")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # 获取数据库会话
 def get_db():
     db = SessionLocal()
@@ -411,7 +569,7 @@ def get_db():
         db.close()
 @app.get("/api/map/search")
 async def search_places_api(keyword: str, city: str = "全国"):
-    results = map_service.search_places(keyword, city)
+    results = await map_service.search_places(keyword, city)
     formatted_results = []
     for poi in results:
         location = poi.get("location", "0,0").split(",")
@@ -433,7 +591,7 @@ async def direction_api(
     """
     mode: driving, walking, bicycling, bus(市内公交), train(高铁/火车), plane(飞机)
     """
-    return map_service.calculate_route(origin, destination, mode)
+    return await map_service.calculate_route(origin, destination, mode)
 @app.post("/api/auth/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == form_data.username).first()
@@ -443,40 +601,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     return {"access_token": access_token, "token_type": "bearer", "user": {"username": user.username, "id": user.id}}
 # 工具函数
 def calculate_trip_stats(user_id: int, db: Session) -> Dict[str, Any]:
-    """计算用户旅行统计数据"""
-    # 总行程数
-    total_trips = db.query(func.count(Trip.id)).filter(Trip.user_id == user_id).scalar()
-
-    # 已完成行程
-    completed_trips = db.query(func.count(Trip.id)).filter(
-        Trip.user_id == user_id,
-        Trip.status == "completed"
-    ).scalar()
-
-    # 总花费
-    total_spent = db.query(func.sum(func.coalesce(Trip.actual_cost, Trip.budget))).filter(
-        Trip.user_id == user_id
-    ).scalar() or 0
-
-    # 探索城市
-    explored_cities = db.query(
-        func.count(func.distinct(Trip.destination))
-    ).filter(Trip.user_id == user_id).scalar()
-
-    # 总天数
-    total_days = db.query(func.sum(Trip.days)).filter(
-        Trip.user_id == user_id
-    ).scalar() or 0
-
-    # 热门标签
-    all_tags = []
-    trips = db.query(Trip).filter(Trip.user_id == user_id).all()
-    for trip in trips:
-        if trip.tags:
-            all_tags.extend(trip.tags)
-
-    from collections import Counter
-    popular_tags = [tag for tag, _ in Counter(all_tags).most_common(5)]
+    """计算用户旅行统计数据（计数读 user_stats 物化行，另查最近行程）"""
+    user_stats = get_user_stats(db, user_id)
 
     # 最近行程
     recent_trips = db.query(Trip).filter(
@@ -487,12 +613,16 @@ def calculate_trip_stats(user_id: int, db: Session) -> Dict[str, Any]:
     monthly_trend = [10, 15, 20, 25, 30, 40, 35, 25, 20, 15, 20, 25]
 
     return {
-        "total_trips": total_trips,
-        "completed_trips": completed_trips,
-        "total_spent": float(total_spent),
-        "explored_cities": explored_cities,
-        "total_days": total_days,
-        "popular_tags": popular_tags,
+        "total_trips": user_stats.total_trips,
+        "completed_trips": user_stats.completed_trips,
+        "total_spent": float(user_stats.total_spent),
+        "explored_cities": len(user_stats.city_counts or {}),
+        "total_days": user_stats.total_days,
+        "popular_tags": [tag for tag, _ in top_counts(user_stats.tag_counts)],
+        "trending_destinations": [
+            {"city": city, "count": count}
+            for city, count in top_counts(user_stats.city_counts)
+        ],
         "monthly_trend": monthly_trend,
         "recent_trips": [
             {
@@ -698,7 +828,7 @@ async def create_trip(
         if (not latitude or not longitude) and trip_data.destination:
             print(f"🗺️ 自动获取 {trip_data.destination} 的坐标...")
             try:
-                geocode_result = map_service.geocode(trip_data.destination)
+                geocode_result = await map_service.geocode(trip_data.destination)
                 if geocode_result and geocode_result.get("location"):
                     location = geocode_result["location"]
                     longitude, latitude = map(float, location.split(','))
@@ -808,30 +938,117 @@ async def create_trip(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"创建旅行记录失败: {str(e)}"
         )
+# 行程列表分页：按 (created_at, id) 倒序的游标分页；TRIPS_PAGE_SIZE 为只传 cursor 时的默认页大小
+TRIPS_PAGE_SIZE = int(os.getenv("TRIPS_PAGE_SIZE", 50))
+TRIPS_MAX_PAGE_SIZE = int(os.getenv("TRIPS_MAX_PAGE_SIZE", 200))
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+# 可选字段 -> (需要查询的列, 序列化函数)；列表视图只查请求的列
+TRIP_LIST_FIELDS = {
+    "id": ((Trip.id,), lambda r: r.id),
+    "name": ((Trip.name,), lambda r: r.name),
+    "destination": ((Trip.destination,), lambda r: r.destination),
+    "description": ((Trip.description,), lambda r: r.description or ""),
+    "days": ((Trip.days,), lambda r: r.days),
+    "people": ((Trip.people,), lambda r: r.people or ""),
+    "budget": ((Trip.budget,), lambda r: float(r.budget or 0)),
+    "actual_cost": ((Trip.actual_cost,), lambda r: r.actual_cost),
+    "status": ((Trip.status,), lambda r: r.status),
+    "start_date": ((Trip.start_date,), lambda r: _iso(r.start_date)),
+    "end_date": ((Trip.end_date,), lambda r: _iso(r.end_date)),
+    "created_at": ((Trip.created_at,), lambda r: _iso(r.created_at)),
+    "updated_at": ((Trip.updated_at,), lambda r: _iso(r.updated_at)),
+    "tags": ((Trip.tags,), lambda r: r.tags or []),
+    "images": ((Trip.images,), lambda r: r.images or []),
+    "notes": ((Trip.notes,), lambda r: r.notes or ""),
+    "rating": ((Trip.rating,), lambda r: r.rating or ""),
+    "latitude": ((Trip.latitude,), lambda r: r.latitude),
+    "longitude": ((Trip.longitude,), lambda r: r.longitude),
+}
+# 不传 fields 时与原接口返回的字段一致
+TRIP_DEFAULT_FIELDS = ("id", "name", "destination", "days", "budget", "status",
+                       "start_date", "tags", "images", "notes", "rating", "people")
+
+
+def encode_trip_cursor(created_at: Optional[datetime], trip_id: int) -> str:
+    raw = json.dumps([_iso(created_at), trip_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_trip_cursor(cursor: str):
+    try:
+        created_at, trip_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(trip_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
 @app.get("/api/trips")
 async def get_user_trips(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db),
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    destination: Optional[str] = None,
+    tags: Optional[str] = Query(None, description="逗号分隔，需同时包含所有标签"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，默认返回全部列表字段"),
+    limit: Optional[int] = Query(None, ge=1, le=TRIPS_MAX_PAGE_SIZE, description="每页条数；limit 与 cursor 都不传时返回全部行程"),
+    cursor: Optional[str] = None
 ):
-    query = db.query(Trip).filter(Trip.user_id == current_user.id)
-    if status: query = query.filter(Trip.status == status)
-    trips = query.order_by(desc(Trip.created_at)).all()
+    """行程列表：按需取列 + 服务端筛选；传 limit 或 cursor 时按游标分页"""
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(TRIP_DEFAULT_FIELDS)
+    unknown = [name for name in names if name not in TRIP_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不支持的字段: {', '.join(unknown)}")
+    if "id" not in names:
+        names.insert(0, "id")
+
+    # 游标需要 created_at 和 id，始终查询
+    columns = {Trip.id.key: Trip.id, Trip.created_at.key: Trip.created_at}
+    for name in names:
+        for column in TRIP_LIST_FIELDS[name][0]:
+            columns[column.key] = column
+    query = db.query(*columns.values()).filter(Trip.user_id == current_user.id)
+
+    if status:
+        query = query.filter(Trip.status == status)
+    if destination:
+        query = query.filter(Trip.destination == destination)
+    for tag in (t.strip() for t in (tags or "").split(",")):
+        if tag:
+            tag_values = func.json_each(Trip.tags).table_valued("value")
+            query = query.filter(select(tag_values.c.value).where(tag_values.c.value == tag).exists())
+
+    if cursor:
+        # 倒序下 NULL 的 created_at 排在最后
+        last_created, last_id = decode_trip_cursor(cursor)
+        if last_created is None:
+            query = query.filter(Trip.created_at.is_(None), Trip.id < last_id)
+        else:
+            query = query.filter(or_(
+                Trip.created_at < last_created,
+                and_(Trip.created_at == last_created, Trip.id < last_id),
+                Trip.created_at.is_(None),
+            ))
+
+    query = query.order_by(desc(Trip.created_at), desc(Trip.id))
+    if limit is None and not cursor:
+        # 未要求分页：保持原有接口行为，一次返回全部
+        rows, has_more = query.all(), False
+    else:
+        limit = limit or TRIPS_PAGE_SIZE
+        # 多取一条用来判断是否还有下一页
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
 
     return {
         "success": True,
-        "trips": [
-            {
-                "id": t.id, "name": t.name, "destination": t.destination,
-                "days": t.days, "budget": float(t.budget), "status": t.status,
-                "start_date": t.start_date.isoformat() if t.start_date else None,
-                "tags": t.tags or [],
-                "images": t.images or [],
-                "notes": t.notes or "",
-                "rating": t.rating or "",
-                "people":t.people or""
-            } for t in trips
-        ]
+        "trips": [{name: TRIP_LIST_FIELDS[name][1](row) for name in names} for row in rows],
+        "next_cursor": encode_trip_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
     }
 # 批量创建旅行记录
 @app.post("/api/trips/batch")
@@ -1094,14 +1311,6 @@ async def get_dashboard_stats(
         UserPreference.user_id == current_user.id
     ).first()
 
-    # 获取热门目的地（基于用户去过的地方）
-    popular_destinations = db.query(
-        Trip.destination,
-        func.count(Trip.id).label('count')
-    ).filter(
-        Trip.user_id == current_user.id
-    ).group_by(Trip.destination).order_by(desc('count')).limit(5).all()
-
     # 用户洞察
     user_insights = []
     if stats["total_trips"] > 0:
@@ -1116,8 +1325,8 @@ async def get_dashboard_stats(
         if interests:
             user_insights.append(f"您的兴趣: {', '.join(interests[:3])}")
 
-    if popular_destinations:
-        top_dest = popular_destinations[0][0]
+    if stats["trending_destinations"]:
+        top_dest = stats["trending_destinations"][0]["city"]
         user_insights.append(f"您最常去的目的地: {top_dest}")
 
     # 推荐
@@ -1141,10 +1350,6 @@ async def get_dashboard_stats(
 
     return {
         **stats,
-        "trending_destinations": [
-            {"city": dest[0], "count": dest[1]}
-            for dest in popular_destinations
-        ],
         "user_insights": user_insights,
         "recommendations": recommendations,
         "user_preferences": {
@@ -1317,9 +1522,26 @@ TRAVEL_STEPS = [
 
 
 # =============== 聊天接口 ===============
+CHAT_SYSTEM_PROMPT = """你是WanderAI，一个专业的旅行规划助手。
+
+你可以使用以下工具获取实时信息：
+1. search_poi - 搜索地点（如：故宫、西湖、外滩）
+2. search_nearby - 搜索周边设施（如：附近的酒店、停车场、餐厅）
+3. search_knowledge_base - 获取旅行技巧（如：避坑指南、省钱技巧）
+
+回复时请：
+1. 保持热情、专业的语气
+2. 提供具体、实用的建议
+3. 使用emoji让回复更生动
+4. 如果需要更多信息，主动询问
+
+现在开始对话："""
+
 @app.post("/api/chat")
 async def chat_with_ai(
     request_data: ChatRequest,
+    http_request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
     db: Session = Depends(get_db)
 ):
     """智能聊天（集成 LLM）"""
@@ -1337,52 +1559,59 @@ async def chat_with_ai(
                 "session_id": session_id,
                 "error": "消息内容为空"
             }
-        current_user = None
-
-        # 系统提示
-        system_prompt = """你是WanderAI，一个专业的旅行规划助手。
-
-你可以使用以下工具获取实时信息：
-1. search_poi - 搜索地点（如：故宫、西湖、外滩）
-2. search_nearby - 搜索周边设施（如：附近的酒店、停车场、餐厅）
-3. search_knowledge_base - 获取旅行技巧（如：避坑指南、省钱技巧）
-
-回复时请：
-1. 保持热情、专业的语气
-2. 提供具体、实用的建议
-3. 使用emoji让回复更生动
-4. 如果需要更多信息，主动询问
-
-现在开始对话："""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": message}
-        ]
-
-        print(f"调用 LLM 引擎，消息数: {len(messages)}")
-
-        # 调用 LLM 引擎
-        try:
-            ai_reply = await call_qwen_with_tools(messages, api_config)
-        except Exception as llm_error:
-            print(f"LLM 调用失败: {llm_error}")
-            # 备用回复
-            ai_reply = generate_simple_fallback_reply(message)
+        # 登录用户带上会话历史（token 预算内，较早轮次压缩为摘要）；匿名访问不保留上下文
+        history = chat_memory.load(db, current_user.id, session_id) if current_user else []
+        messages = build_chat_messages(CHAT_SYSTEM_PROMPT, history, message)
+
+        # 无会话历史（无个人上下文）时才能复用他人的回答
+        cacheable = not history
+        cache_hit = chat_cache.get(message) if cacheable else None
+        if cache_hit:
+            print(f"命中语义缓存（相似度 {cache_hit['similarity']}）: {cache_hit['matched']}")
+            ai_reply = cache_hit["reply"]
+            failed = False
+        else:
+            print(f"调用 LLM 引擎，消息数: {len(messages)}")
 
-        print(f"AI 回复成功，长度: {len(ai_reply)} 字符")
+            # 调用 LLM 引擎
+            try:
+                ai_reply = await run_until_disconnect(http_request, call_qwen_with_tools(
+                    messages, api_config, cache_query=message if cacheable else None
+                ))
+                failed = is_error_reply(ai_reply)
+            except HTTPException:
+                raise
+            except Exception as llm_error:
+                print(f"LLM 调用失败: {llm_error}")
+                # 备用回复
+                ai_reply = generate_simple_fallback_reply(message)
+                failed = True
+
+            print(f"AI 回复成功，长度: {len(ai_reply)} 字符")
 
         # 检测是否使用了工具
         has_tools = any(keyword in ai_reply.lower() for keyword in ["搜索到", "找到", "查询到", "推荐"])
 
+        # 出错时的提示/备用回复不写入对话记忆，免得下一轮把它当作上下文
+        if current_user and not failed:
+            try:
+                chat_memory.append(db, current_user.id, session_id, message, ai_reply,
+                                   {"cached": bool(cache_hit), "has_tools": has_tools})
+            except Exception as e:
+                db.rollback()
+                print(f"保存聊天记录失败: {e}")
+
         return {
             "reply": ai_reply,
             "session_id": session_id,
             "model": "qwen-turbo",
             "has_tools": has_tools,
+            "cached": bool(cache_hit),
             "timestamp": datetime.utcnow().isoformat()
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"聊天接口错误: {str(e)}")
         import traceback
@@ -1395,6 +1624,75 @@ async def chat_with_ai(
             "fallback": True
         }
 
+@app.post("/api/chat/stream")
+async def chat_with_ai_stream(
+    request_data: ChatRequest,
+    http_request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: Session = Depends(get_db)
+):
+    """流式聊天（SSE）：推送工具调用进度与回复增量"""
+    message = request_data.message
+    session_id = request_data.session_id or "default"
+    api_config = request_data.api_config or {}
+    user_id = current_user.id if current_user else None
+    print(f"收到流式聊天消息: {message}")
+
+    history = chat_memory.load(db, user_id, session_id) if user_id else []
+    messages = build_chat_messages(CHAT_SYSTEM_PROMPT, history, message)
+
+    async def event_stream():
+        if not message:
+            yield sse_event("error", {"message": "请发送有效的消息内容"})
+            return
+
+        reply_parts = []
+        used_tools = False
+        stream = stream_qwen_with_tools(messages, api_config)
+        try:
+            async for event in stream:
+                # 客户端断开后立即停止，未执行完的工具与 LLM 流随之取消
+                if await http_request.is_disconnected():
+                    print("客户端已断开，停止流式聊天")
+                    return
+                event_type = event.pop("type")
+                if event_type == "delta":
+                    reply_parts.append(event["text"])
+                else:
+                    used_tools = True
+                yield sse_event(event_type, event)
+
+            ai_reply = "".join(reply_parts)
+            print(f"AI 流式回复完成，长度: {len(ai_reply)} 字符")
+
+            if user_id and ai_reply and not is_error_reply(ai_reply):
+                # 请求级的 db 会话此时可能已关闭，单独开会话落库
+                db_session = SessionLocal()
+                try:
+                    chat_memory.append(db_session, user_id, session_id, message, ai_reply, {"has_tools": used_tools})
+                except Exception as e:
+                    db_session.rollback()
+                    print(f"保存聊天记录失败: {e}")
+                finally:
+                    db_session.close()
+            yield sse_event("done", {
+                "session_id": session_id,
+                "model": "qwen-turbo",
+                "has_tools": used_tools,
+                "timestamp": datetime.utcnow().isoformat()
+            })
+        except Exception as e:
+            print(f"流式聊天错误: {str(e)}")
+            yield sse_event("error", {"message": "抱歉，我遇到了一些技术问题。请稍后再试。", "detail": str(e)[:100]})
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 def generate_simple_fallback_reply(message: str) -> str:
     """简单的备用回复"""
     message_lower = message.lower()
@@ -1530,26 +1828,46 @@ def generate_smart_fallback_reply(message: str, history, user: Optional[User], d
 
 # =============== 修复行程生成接口 ===============
 
-class GeneratePlanRequest(BaseModel):
-    """行程生成请求模型"""
-    origin: str = "当前城市"
-    destination: str
-    days: int = 3
-    people: int = 2
-    budget: str = "适中"
-    transport: str = "公共交通"
-    pace: str = "适中"
-    who_with: str = "朋友"
-    tags: List[str] = []
-    preferences: str = "无特殊偏好"
-    api_config: Dict[str, Any] = {}
+def save_generated_trip(db: Session, user: User, request: GeneratePlanRequest, plan: str) -> Trip:
+    """保存 AI 生成的计划为旅行记录，并更新收藏城市与积分"""
+    trip = Trip(
+        user_id=user.id,
+        name=f"{request.destination} {request.days}日游",
+        destination=request.destination,
+        description=f"AI 生成的旅行计划 - {request.destination} {request.days}天",
+        days=request.days,
+        people=request.people,
+        budget=estimate_budget(request.budget, request.days, request.people),
+        tags=request.tags,
+        status="generated",
+        notes=f"生成时间: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}\n\n{plan[:500]}..."
+    )
 
-    class Config:
-        extra = "ignore"  # 忽略额外字段
+    db.add(trip)
+
+    # 更新用户偏好（添加目的地到收藏城市）
+    user_prefs = db.query(UserPreference).filter(
+        UserPreference.user_id == user.id
+    ).first()
+
+    if user_prefs:
+        if user_prefs.favorite_cities is None:
+            user_prefs.favorite_cities = []
+        if request.destination not in user_prefs.favorite_cities:
+            user_prefs.favorite_cities.append(request.destination)
+            user_prefs.updated_at = datetime.utcnow()
+
+    # 更新用户积分
+    user.points += 30  # 生成计划奖励更多积分
+
+    db.commit()
+    db.refresh(trip)
+    return trip
 
 @app.post("/api/generate-plan")
 async def generate_travel_plan(
     request: GeneratePlanRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -1557,65 +1875,43 @@ async def generate_travel_plan(
     print(f"生成旅行计划请求: {request.destination} {request.days}天")
 
     try:
-        # 直接使用请求对象中的参数
-        plan = await generate_full_plan(
-            origin=request.origin,
-            destination=request.destination,
-            days=request.days,
-            people=request.people,
-            preferences=request.preferences,
-            budget=request.budget,
-            transport=request.transport,
-            pace=request.pace,
-            who_with=request.who_with,
-            tags=request.tags,
-            api_config=request.api_config
-        )
-
-        print(f"AI 计划生成成功，长度: {len(plan)} 字符")
+        # 热门目的地/参数组合直接命中计划缓存
+        plan = await asyncio.to_thread(plan_cache.get, request.model_dump())
+        cached = plan is not None
+        if cached:
+            print(f"命中计划缓存: {request.destination} {request.days}天")
+        else:
+            # 直接使用请求对象中的参数
+            plan = await run_until_disconnect(http_request, generate_full_plan(
+                origin=request.origin,
+                destination=request.destination,
+                days=request.days,
+                people=request.people,
+                preferences=request.preferences,
+                budget=request.budget,
+                transport=request.transport,
+                pace=request.pace,
+                who_with=request.who_with,
+                tags=request.tags,
+                api_config=request.api_config
+            ))
+
+            print(f"AI 计划生成成功，长度: {len(plan)} 字符")
 
         # 自动创建旅行记录
-        trip = Trip(
-            user_id=current_user.id,
-            name=f"{request.destination} {request.days}日游",
-            destination=request.destination,
-            description=f"AI 生成的旅行计划 - {request.destination} {request.days}天",
-            days=request.days,
-            people=request.people,
-            budget=estimate_budget(request.budget, request.days, request.people),
-            tags=request.tags,
-            status="generated",
-            notes=f"生成时间: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}\n\n{plan[:500]}..."
-        )
-
-        db.add(trip)
-
-        # 更新用户偏好（添加目的地到收藏城市）
-        user_prefs = db.query(UserPreference).filter(
-            UserPreference.user_id == current_user.id
-        ).first()
-
-        if user_prefs:
-            if user_prefs.favorite_cities is None:
-                user_prefs.favorite_cities = []
-            if request.destination not in user_prefs.favorite_cities:
-                user_prefs.favorite_cities.append(request.destination)
-                user_prefs.updated_at = datetime.utcnow()
-
-        # 更新用户积分
-        current_user.points += 30  # 生成计划奖励更多积分
-
-        db.commit()
-        db.refresh(trip)
+        trip = save_generated_trip(db, current_user, request, plan)
 
         return {
             "success": True,
             "plan": plan,
             "reply": plan,  # 为了前端兼容性
             "trip_id": trip.id,
+            "cached": cached,
             "message": "旅行计划生成成功"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"生成计划错误: {str(e)}")
         import traceback
@@ -1643,7 +1939,9 @@ async def generate_travel_plan(
                 {"role": "user", "content": fallback_prompt}
             ]
 
-            fallback_plan = await call_qwen_with_tools(messages, request.api_config)
+            fallback_plan = await run_until_disconnect(
+                http_request, call_qwen_with_tools(messages, request.api_config)
+            )
 
             return {
                 "success": True,
@@ -1652,6 +1950,8 @@ async def generate_travel_plan(
                 "message": "使用备选方案生成成功"
             }
 
+        except HTTPException:
+            raise
         except Exception as fallback_error:
             print(f"备选方案也失败: {fallback_error}")
 
@@ -1662,9 +1962,88 @@ async def generate_travel_plan(
                 "message": "请检查 API 配置或稍后再试"
             }
 
+@app.post("/api/generate-plan/stream")
+async def generate_travel_plan_stream(
+    request: GeneratePlanRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """流式生成旅行计划（SSE）：逐段推送 Markdown，完成后保存旅行记录"""
+    print(f"流式生成旅行计划请求: {request.destination} {request.days}天")
+    user_id = current_user.id
+
+    async def event_stream():
+        cached_plan = await asyncio.to_thread(plan_cache.get, request.model_dump())
+        if cached_plan is not None:
+            print(f"命中计划缓存: {request.destination} {request.days}天")
+            yield sse_event("chunk", {"text": cached_plan})
+            db = SessionLocal()
+            try:
+                user = db.query(User).filter(User.id == user_id).first()
+                trip = save_generated_trip(db, user, request, cached_plan)
+                yield sse_event("done", {"trip_id": trip.id, "length": len(cached_plan), "cached": True,
+                                         "message": "旅行计划生成成功"})
+            except Exception as e:
+                print(f"保存缓存计划失败: {str(e)}")
+                yield sse_event("error", {"message": f"生成计划时出错: {str(e)}"})
+            finally:
+                db.close()
+            return
+
+        parts = []
+        stream = stream_full_plan(
+            origin=request.origin,
+            destination=request.destination,
+            days=request.days,
+            people=request.people,
+            preferences=request.preferences,
+            budget=request.budget,
+            transport=request.transport,
+            pace=request.pace,
+            who_with=request.who_with,
+            tags=request.tags,
+            api_config=request.api_config
+        )
+        try:
+            async for chunk in stream:
+                if await http_request.is_disconnected():
+                    print("客户端已断开，停止流式生成")
+                    return
+                parts.append(chunk)
+                yield sse_event("chunk", {"text": chunk})
+
+            plan = "".join(parts)
+            if not plan:
+                yield sse_event("error", {"message": "AI 未返回内容，请稍后再试"})
+                return
+            print(f"AI 计划流式生成完成，长度: {len(plan)} 字符")
+
+            # 流结束后再落库（请求级的 db 会话此时可能已关闭，单独开会话）
+            db = SessionLocal()
+            try:
+                user = db.query(User).filter(User.id == user_id).first()
+                trip = save_generated_trip(db, user, request, plan)
+                yield sse_event("done", {"trip_id": trip.id, "length": len(plan), "cached": False,
+                                         "message": "旅行计划生成成功"})
+            finally:
+                db.close()
+
+        except Exception as e:
+            print(f"流式生成计划错误: {str(e)}")
+            yield sse_event("error", {"message": f"生成计划时出错: {str(e)}"})
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/generate")
 async def legacy_generate_plan(
-    request: Dict[str, Any]
+    request: Dict[str, Any],
+    http_request: Request
 ):
     """兼容旧的 /generate 端点"""
     print("接收到 /generate 请求")
@@ -1685,28 +2064,34 @@ async def legacy_generate_plan(
             api_config=request.get("api_config", {})
         )
 
-        # 直接调用 generate_full_plan 函数
-        plan = await generate_full_plan(
-            origin=generate_request.origin,
-            destination=generate_request.destination,
-            days=generate_request.days,
-            people=generate_request.people,
-            preferences=generate_request.preferences,
-            budget=generate_request.budget,
-            transport=generate_request.transport,
-            pace=generate_request.pace,
-            who_with=generate_request.who_with,
-            tags=generate_request.tags,
-            api_config=generate_request.api_config
-        )
+        plan = await asyncio.to_thread(plan_cache.get, generate_request.model_dump())
+        cached = plan is not None
+        if not cached:
+            # 直接调用 generate_full_plan 函数
+            plan = await run_until_disconnect(http_request, generate_full_plan(
+                origin=generate_request.origin,
+                destination=generate_request.destination,
+                days=generate_request.days,
+                people=generate_request.people,
+                preferences=generate_request.preferences,
+                budget=generate_request.budget,
+                transport=generate_request.transport,
+                pace=generate_request.pace,
+                who_with=generate_request.who_with,
+                tags=generate_request.tags,
+                api_config=generate_request.api_config
+            ))
 
         return {
             "success": True,
             "plan": plan,
             "reply": plan,
+            "cached": cached,
             "message": "旅行计划生成成功"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"/generate 接口错误: {e}")
 
@@ -1880,6 +2265,31 @@ async def root():
     }
 
 
+# 探索城市：按目的地分组一次算完，标签用 json_each 相关子查询去重
+EXPLORED_CITIES_SQL = text("""
+    SELECT
+        t.destination AS city,
+        SUM(CASE WHEN t.status = 'completed' THEN 1 ELSE 0 END) AS visit_count,
+        SUM(COALESCE(t.days, 0)) AS total_days,
+        SUM(COALESCE(t.actual_cost, 0)) AS total_spent,
+        MIN(t.start_date) AS first_visit,
+        MAX(t.start_date) AS last_visit,
+        AVG(CASE WHEN t.longitude IS NOT NULL THEN t.latitude END) AS latitude,
+        AVG(CASE WHEN t.latitude IS NOT NULL THEN t.longitude END) AS longitude,
+        (
+            SELECT json_group_array(DISTINCT tag.value)
+            FROM trips t2, json_each(t2.tags) AS tag
+            WHERE t2.user_id = t.user_id AND t2.destination = t.destination
+              AND json_valid(t2.tags)
+        ) AS tags
+    FROM trips t
+    WHERE t.user_id = :user_id
+    GROUP BY t.destination
+    HAVING visit_count > 0
+    ORDER BY t.destination
+""").columns(first_visit=DateTime, last_visit=DateTime)
+
+
 # 获取用户探索过的所有城市及其坐标
 @app.get("/api/dashboard/explored-cities")
 async def get_explored_cities(
@@ -1888,45 +2298,33 @@ async def get_explored_cities(
 ):
     """获取用户探索过的所有城市及其坐标"""
     try:
-        # 获取用户去过的所有目的地
-        destinations = db.query(
-            Trip.destination,
-            func.count(Trip.id).label('visit_count')
-        ).filter(
-            Trip.user_id == current_user.id,
-            Trip.status == "completed"
-        ).group_by(Trip.destination).all()
+        # 一次分组查询拿到每个城市的全部统计；visit_count 只计已完成的行程
+        rows = db.execute(EXPLORED_CITIES_SQL, {"user_id": current_user.id}).all()
 
-        explored_cities = []
+        # 优先用行程里保存的坐标，缺坐标的城市并发地理编码（走两级缓存）
+        missing = [row.city for row in rows if row.latitude is None or row.longitude is None]
+        geocoded = await map_service.geocode_many(missing) if missing else {}
 
-        for dest, count in destinations:
-            # 使用地图服务获取城市坐标
-            geocode_result = map_service.geocode(dest)
-            if geocode_result:
-                location = geocode_result["location"]
-                lng, lat = map(float, location.split(','))
-
-                # 获取这个城市的旅行记录
-                city_trips = db.query(Trip).filter(
-                    Trip.user_id == current_user.id,
-                    Trip.destination == dest
-                ).all()
-
-                # 统计这个城市的旅行信息
-                total_days = sum(trip.days for trip in city_trips)
-                total_spent = sum(float(trip.actual_cost or 0) for trip in city_trips)
-
-                explored_cities.append({
-                    "city": dest,
-                    "latitude": lat,
-                    "longitude": lng,
-                    "visit_count": count,
-                    "total_days": total_days,
-                    "total_spent": total_spent,
-                    "first_visit": min(trip.start_date for trip in city_trips if trip.start_date).isoformat() if any(trip.start_date for trip in city_trips) else None,
-                    "last_visit": max(trip.start_date for trip in city_trips if trip.start_date).isoformat() if any(trip.start_date for trip in city_trips) else None,
-                    "tags": list(set(tag for trip in city_trips if trip.tags for tag in trip.tags))[:5]  # 最多5个标签
-                })
+        explored_cities = []
+        for row in rows:
+            lat, lng = row.latitude, row.longitude
+            if lat is None or lng is None:
+                geocode_result = geocoded.get(row.city)
+                if not geocode_result:
+                    continue
+                lng, lat = map(float, geocode_result["location"].split(','))
+
+            explored_cities.append({
+                "city": row.city,
+                "latitude": lat,
+                "longitude": lng,
+                "visit_count": row.visit_count,
+                "total_days": row.total_days,
+                "total_spent": float(row.total_spent),
+                "first_visit": row.first_visit.isoformat() if row.first_visit else None,
+                "last_visit": row.last_visit.isoformat() if row.last_visit else None,
+                "tags": json.loads(row.tags or "[]")[:5]  # 最多5个标签
+            })
 
         return {
             "success": True,
@@ -1985,145 +2383,9 @@ async def get_stats_details(
 ):
     """获取高阶数据分析 - 修复日期类型错误版"""
     try:
-        trips = db.query(Trip).filter(Trip.user_id == current_user.id).all()
-        
-        # === 1. 基础数据 ===
-        total_trips = len(trips)
-        if total_trips == 0:
-            return {
-                "success": True, 
-                "empty": True,
-                "monthly_frequency": [], "budget_distribution": [], "season_preference": [],
-                "advanced_stats": {
-                    "travel_dna": [{"subject": "无数据", "A": 0, "fullMark": 100}],
-                    "kpi": {}
-                }
-            }
-
-        total_days = sum((t.days or 0) for t in trips)
-        total_spent = sum((t.budget or 0) for t in trips)
-        
-        # === 2. 规划习惯分析 (核心修复点) ===
-        lead_times = []
-        for t in trips:
-            if t.start_date:
-                # 1. 处理 created_at (转为 date)
-                if isinstance(t.created_at, str):
-                    created = datetime.strptime(t.created_at, "%Y-%m-%d %H:%M:%S").date()
-                elif t.created_at:
-                    created = t.created_at.date()
-                else:
-                    created = datetime.utcnow().date()
-
-                # 2. 处理 start_date 
-                start = t.start_date
-                if isinstance(start, datetime): # 如果是 datetime 对象，取 .date()
-                    start = start.date()
-                elif isinstance(start, str):    # 如果是字符串，解析后取 .date()
-                    try: 
-                        # 尝试只解析日期
-                        start = datetime.strptime(start, "%Y-%m-%d").date()
-                    except:
-                        try:
-                            # 尝试解析完整时间
-                            start = datetime.strptime(start, "%Y-%m-%d %H:%M:%S").date()
-                        except:
-                            continue # 解析不了就跳过
-                
-                # 3. 现在的 start 和 created 肯定都是 date 类型了，可以相减
-                delta = (start - created).days
-                lead_times.append(max(0, delta))
-        
-        avg_lead_time = sum(lead_times) / len(lead_times) if lead_times else 0
-        
-        # === 3. 成本效率分析 ===
-        cpppd_list = []
-        for t in trips:
-            if (t.days or 0) > 0 and (t.people or 0) > 0:
-                cpppd = (t.budget or 0) / (t.days * t.people)
-                cpppd_list.append(cpppd)
-        avg_cpppd = sum(cpppd_list) / len(cpppd_list) if cpppd_list else 0
-
-        # === 4. 地理距离 ===
-        home_lat, home_lon = 39.9042, 116.4074 
-        total_distance = 0
-        for t in trips:
-            dist = haversine_distance(home_lat, home_lon, t.latitude, t.longitude)
-            total_distance += dist * 2 
-        
-        # === 5. 人格计算 ===
-        unique_cities = len(set(t.destination for t in trips if t.destination))
-        score_exploration = min(100, (unique_cities / total_trips) * 100) if total_trips else 0
-        score_luxury = min(100, (avg_cpppd / 2000) * 100)
-        
-        avg_people = sum((t.people or 1) for t in trips) / total_trips
-        score_social = min(100, (avg_people / 6) * 100)
-        
-        score_spontaneity = max(0, 100 - (avg_lead_time / 60 * 100))
-        
-        avg_days = total_days / total_trips if total_trips else 0
-        score_intensity = max(0, min(100, (7 - avg_days) * 20 + 20))
-
-        # === 6. 图表数据查询 ===
-        monthly_data = db.query(
-            func.strftime('%Y-%m', Trip.start_date).label('month'), 
-            func.count(Trip.id).label('trip_count')
-        ).filter(
-            Trip.user_id == current_user.id, 
-            Trip.start_date.isnot(None)
-        ).group_by('month').all()
-        
-        season_stats = db.query(
-            case(
-                (func.strftime('%m', Trip.start_date).in_(['12', '01', '02']), "冬季"),
-                (func.strftime('%m', Trip.start_date).in_(['03', '04', '05']), "春季"),
-                (func.strftime('%m', Trip.start_date).in_(['06', '07', '08']), "夏季"),
-                (func.strftime('%m', Trip.start_date).in_(['09', '10', '11']), "秋季"),
-                else_="未知"
-            ).label('season'),
-            func.count(Trip.id).label('count')
-        ).filter(
-            Trip.user_id == current_user.id, 
-            Trip.start_date.isnot(None)
-        ).group_by('season').all()
-        
-        budget_stats = db.query(
-            case(
-                (Trip.budget < 1000, "经济"),
-                (Trip.budget < 3000, "适中"),
-                else_="豪华"
-            ).label('budget_level'),
-            func.count(Trip.id).label('count')
-        ).filter(
-            Trip.user_id == current_user.id
-        ).group_by('budget_level').all()
-
-        return {
-            "success": True,
-            "basic_stats": {
-                "total_trips": total_trips,
-                "total_days": total_days,
-                "total_spent": total_spent,
-                "completed_trips": len([t for t in trips if t.status == 'completed'])
-            },
-            "advanced_stats": {
-                "travel_dna": [
-                    {"subject": "探索度", "A": int(score_exploration), "fullMark": 100},
-                    {"subject": "奢华度", "A": int(score_luxury), "fullMark": 100},
-                    {"subject": "社交度", "A": int(score_social), "fullMark": 100},
-                    {"subject": "行动力", "A": int(score_spontaneity), "fullMark": 100},
-                    {"subject": "特种兵", "A": int(score_intensity), "fullMark": 100},
-                ],
-                "kpi": {
-                    "total_distance_km": int(total_distance),
-                    "avg_lead_time_days": int(avg_lead_time),
-                    "avg_spend_per_person_day": int(avg_cpppd)
-                }
-            },
-            "monthly_frequency": [{"month": m.month, "trip_count": m.trip_count} for m in monthly_data],
-            "budget_distribution": [{"level": b.budget_level, "count": b.count} for b in budget_stats],
-            "season_preference": [{"season": s.season, "count": s.count} for s in season_stats]
-        }
+        # 所有累计量均由 user_stats 物化行增量维护，这里只做 O(1) 的派生计算
+        st = get_user_stats(db, current_user.id)
+        return build_stats_details(stats_to_dict(st))
 
     except Exception as e:
         import traceback
@@ -0,0 +1,176 @@
+# backend/plan_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from cache_utils import LRUCache, MISSING
+from database import SessionLocal, PlanCacheEntry
+
+# 计划缓存 7 天，最多保留 500 条（超出时淘汰最久未命中的）
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", 7 * 24 * 3600))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", 500))
+PLAN_CACHE_MEMORY_SIZE = int(os.getenv("PLAN_CACHE_MEMORY_SIZE", 128))
+# 每写入多少次顺带清理一次过期/超量行
+EVICT_EVERY_WRITES = 20
+
+# 参与缓存键的请求字段（api_config 等与计划内容无关的字段不计入）
+PLAN_CACHE_FIELDS = ("origin", "destination", "days", "people", "budget",
+                     "transport", "pace", "who_with", "tags", "preferences")
+
+
+def _normalize(value: str) -> str:
+    text = unicodedata.normalize("NFKC", str(value or ""))
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def canonical_plan_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """规范化请求字段：字符串归一化、目的地去掉“市”后缀、标签去重排序"""
+    canonical = {}
+    for name in PLAN_CACHE_FIELDS:
+        value = fields.get(name)
+        if name in ("days", "people"):
+            canonical[name] = int(value or 0)
+        elif name == "tags":
+            canonical[name] = sorted({_normalize(tag) for tag in (value or []) if _normalize(tag)})
+        else:
+            canonical[name] = _normalize(value)
+    if canonical["destination"].endswith("市") and len(canonical["destination"]) > 2:
+        canonical["destination"] = canonical["destination"][:-1]
+    return canonical
+
+
+def plan_cache_key(fields: Dict[str, Any]) -> str:
+    payload = json.dumps(canonical_plan_fields(fields), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """两级行程计划缓存：进程内 LRU + SQLite 表 (plan_cache)，带 TTL 与条数上限"""
+
+    def __init__(self, maxsize: int = PLAN_CACHE_MEMORY_SIZE, ttl: int = PLAN_CACHE_TTL,
+                 max_entries: int = PLAN_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, fields: Dict[str, Any]) -> Optional[str]:
+        """返回缓存的计划文本，未命中返回 None"""
+        key = plan_cache_key(fields)
+        plan = self._memory.get(key)
+        if plan is not MISSING:
+            with self._lock:
+                self.memory_hits += 1
+            return plan
+
+        db = SessionLocal()
+        try:
+            entry = db.query(PlanCacheEntry).filter(PlanCacheEntry.cache_key == key).first()
+            if entry and entry.expires_at > datetime.utcnow():
+                entry.hits = (entry.hits or 0) + 1
+                entry.last_hit_at = datetime.utcnow()
+                db.commit()
+                remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+                self._memory.set(key, entry.plan, ttl=max(1, remaining))
+                with self._lock:
+                    self.db_hits += 1
+                return entry.plan
+        except Exception as e:
+            db.rollback()
+            print(f"Plan Cache Read Error: {e}")
+        finally:
+            db.close()
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, fields: Dict[str, Any], plan: str):
+        """写入缓存（只应写入大模型成功生成的计划）"""
+        if not plan:
+            return
+        key = plan_cache_key(fields)
+        canonical = canonical_plan_fields(fields)
+        self._memory.set(key, plan, ttl=self.ttl)
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            db.merge(PlanCacheEntry(
+                cache_key=key,
+                destination=canonical["destination"],
+                days=canonical["days"],
+                plan=plan,
+                hits=0,
+                created_at=now,
+                last_hit_at=now,
+                expires_at=now + timedelta(seconds=self.ttl)
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Plan Cache Write Error: {e}")
+        finally:
+            db.close()
+
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY_WRITES == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """删除过期行，并把总条数压到上限以内（先淘汰最久未命中的）"""
+        db = SessionLocal()
+        try:
+            deleted = db.query(PlanCacheEntry).filter(
+                PlanCacheEntry.expires_at <= datetime.utcnow()
+            ).delete(synchronize_session=False)
+            overflow = db.query(PlanCacheEntry).count() - self.max_entries
+            if overflow > 0:
+                stale = [key for key, in db.query(PlanCacheEntry.cache_key).order_by(
+                    PlanCacheEntry.last_hit_at.asc()
+                ).limit(overflow)]
+                deleted += db.query(PlanCacheEntry).filter(
+                    PlanCacheEntry.cache_key.in_(stale)
+                ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            print(f"Plan Cache Evict Error: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        db = SessionLocal()
+        try:
+            entries = db.query(PlanCacheEntry).count()
+        except Exception:
+            entries = None
+        finally:
+            db.close()
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "memory": self._memory.stats()
+        }
+
+
+plan_cache = PlanCache()
@@ -1,9 +1,21 @@
 import os
+import asyncio
+import json
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
 import dashscope
 from chromadb import Documents, EmbeddingFunction, Embeddings
-from typing import List
+from typing import List, Optional
 from dotenv import load_dotenv
+from embedding_cache import CachedEmbedding, persisting as embedding_persisting
+from local_embedding import HashingNgramEmbedding, normalize_text
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from cache_utils import LRUCache, MISSING
+from chunker import CHUNKER_VERSION, TOPIC_KEYWORDS, chunk_file, normalize_city
 import os
 os.environ['ANONYMIZED_TELEMETRY'] = 'False'
 os.environ['CHROMA_TELEMETRY'] = 'False'
@@ -11,48 +23,84 @@ os.environ['CHROMA_TELEMETRY'] = 'False'
 load_dotenv()
 dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
 
+# text-embedding-v1 单次请求最多 25 条文本
+EMBEDDING_MODEL = "text-embedding-v1"
+EMBEDDING_BATCH_SIZE = 25
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 3))
+
+
+class EmbeddingError(RuntimeError):
+    """嵌入接口调用失败（重试耗尽）"""
+
+
 class DashScopeEmbedding(EmbeddingFunction):
-    def __call__(self, input: Documents) -> Embeddings:
-        embeddings = []
-        for text in input:
-            try:
-                resp = dashscope.TextEmbedding.call(
-                    model="text-embedding-v1",
-                    input=text
-                )
+    """
+    DashScope 文本嵌入：按接口上限分批，线程池并发请求，失败批次指数退避重试。
+    任何批次最终失败都会抛出 EmbeddingError，而不是写入零向量污染索引。
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_workers: int = EMBEDDING_MAX_WORKERS, max_retries: int = EMBEDDING_MAX_RETRIES):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+    @staticmethod
+    def _parse_embeddings(resp, expected: int) -> List[List[float]]:
+        # 检查响应结构
+        if hasattr(resp, 'output') and hasattr(resp.output, 'embeddings'):
+            embedding_data = resp.output.embeddings
+        elif hasattr(resp, 'embeddings'):
+            embedding_data = resp.embeddings
+        elif isinstance(resp, dict) and 'output' in resp and 'embeddings' in resp['output']:
+            embedding_data = resp['output']['embeddings']
+        elif isinstance(getattr(resp, 'output', None), dict) and 'embeddings' in resp.output:
+            embedding_data = resp.output['embeddings']
+        else:
+            raise EmbeddingError(f"无法识别的响应结构: {resp}")
+
+        if not isinstance(embedding_data, list) or len(embedding_data) != expected:
+            raise EmbeddingError(f"嵌入数量不匹配: 期望 {expected}，实际 {len(embedding_data or [])}")
 
+        # 按 text_index 还原输入顺序
+        if isinstance(embedding_data[0], dict) and 'embedding' in embedding_data[0]:
+            embedding_data = sorted(embedding_data, key=lambda item: item.get('text_index', 0))
+            return [item['embedding'] for item in embedding_data]
+        return list(embedding_data)
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = dashscope.TextEmbedding.call(model=self.model, input=batch)
                 if resp.status_code == 200:
-                    # 检查响应结构
-                    if hasattr(resp, 'output') and hasattr(resp.output, 'embeddings'):
-                        embedding_data = resp.output.embeddings
-                    elif hasattr(resp, 'embeddings'):
-                        embedding_data = resp.embeddings
-                    elif isinstance(resp, dict) and 'output' in resp and 'embeddings' in resp['output']:
-                        embedding_data = resp['output']['embeddings']
-                    else:
-                        print(f"无法识别的响应结构: {resp}")
-                        embeddings.append([0.0] * 1536)
-                        continue
-                    
-                    # 提取嵌入向量
-                    if isinstance(embedding_data, list) and len(embedding_data) > 0:
-                        if isinstance(embedding_data[0], dict) and 'embedding' in embedding_data[0]:
-                            embeddings.append(embedding_data[0]['embedding'])
-                        else:
-                            embeddings.append(embedding_data[0])
-                    else:
-                        embeddings.append([0.0] * 1536)
-                        
-                else:
-                    print(f"Embedding 错误: {resp}")
-                    embeddings.append([0.0] * 1536)
-                    
+                    return self._parse_embeddings(resp, len(batch))
+                last_error = EmbeddingError(f"Embedding 错误: {resp.code} - {resp.message}")
+            except EmbeddingError:
+                raise
             except Exception as e:
-                print(f"Embedding 异常: {e}")
-                embeddings.append([0.0] * 1536)
-        return embeddings
+                last_error = e
+            if attempt < self.max_retries:
+                time.sleep(random.uniform(0, 0.5 * (2 ** attempt)))
+        raise EmbeddingError(f"批量嵌入失败（已重试 {self.max_retries} 次）: {last_error}")
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            results = list(pool.map(self._embed_batch, batches))
+        return [vector for batch in results for vector in batch]
 
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHROMA_PATH = os.getenv("CHROMA_PATH", os.path.join(BASE_DIR, "chroma_db"))
+chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
 
 class SimpleEmbedding(EmbeddingFunction):
     def __call__(self, input: Documents) -> Embeddings:
@@ -70,102 +118,437 @@ class SimpleEmbedding(EmbeddingFunction):
             embeddings.append(embedding)
         return embeddings
 
-# Create or get collection - 使用简单嵌入函数避免错误
-try:
-    collection = chroma_client.get_or_create_collection(
-        name="travel_knowledge",
-        embedding_function=SimpleEmbedding()  # 使用简单的嵌入函数
+# 嵌入后端（按集合选择，不同后端向量维度不同，因此各用独立的集合）：
+# - local:     本地哈希 n-gram 嵌入，离线、确定、对中文友好（默认）
+# - dashscope: 带磁盘缓存的 DashScope 嵌入，未变化的文本块不再重复计费
+# - simple:    旧版随机向量，仅用于兼容已有的 travel_knowledge 集合
+RAG_EMBEDDING_BACKEND = os.getenv("RAG_EMBEDDING_BACKEND", "local")
+
+EMBEDDING_BACKENDS = {
+    "local": lambda: HashingNgramEmbedding(),
+    "dashscope": lambda: CachedEmbedding(DashScopeEmbedding(), EMBEDDING_MODEL),
+    "simple": lambda: SimpleEmbedding(),
+}
+
+def collection_name_for(backend: str) -> str:
+    return "travel_knowledge" if backend == "simple" else f"travel_knowledge_{backend}"
+
+def get_collection(backend: str = RAG_EMBEDDING_BACKEND):
+    """获取（或创建）指定嵌入后端对应的集合"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"未知的嵌入后端: {backend}")
+    return chroma_client.get_or_create_collection(
+        name=collection_name_for(backend),
+        embedding_function=EMBEDDING_BACKENDS[backend]()
     )
-    print(" RAG 知识库初始化成功")
+
+# Create or get collection
+try:
+    collection = get_collection(RAG_EMBEDDING_BACKEND)
+    print(f" RAG 知识库初始化成功 (嵌入后端: {RAG_EMBEDDING_BACKEND})")
 except Exception as e:
     print(f" RAG 初始化失败: {e}")
     collection = None
 
-def ingest_knowledge_base(file_path: str):
+# 词法检索索引（BM25），与向量检索结果做倒数排名融合
+bm25_index = BM25Index()
+_bm25_loaded = False
+_bm25_load_lock = threading.Lock()
+HYBRID_CANDIDATES = 10  # 每路召回的候选数
+EXACT_MATCH_MAX_LEN = 12  # 视为“关键词”查询的最大长度
+
+# 检索结果缓存：键为 (知识库版本, 归一化查询, n_results, 城市, 主题)
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+search_cache = LRUCache(maxsize=SEARCH_CACHE_SIZE)
+_kb_version = 0
+
+# 知识库目录：其下所有 .txt / .md 文件都会被导入，后台定时轮询变化
+KNOWLEDGE_BASE_DIR = os.getenv("KNOWLEDGE_BASE_DIR", os.path.join(BASE_DIR, "knowledge_base"))
+KNOWLEDGE_FILE_EXTENSIONS = (".txt", ".md")
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", 5))
+KB_WATCH_DEBOUNCE = float(os.getenv("KB_WATCH_DEBOUNCE", 2))
+_sync_lock = threading.Lock()
+_status_lock = threading.Lock()
+_ingest_status = {}  # 来源名 -> 最近一次导入状态
+_last_sync = None
+
+# 增量导入清单（每个集合一份）：记录每个文件的 mtime / 内容哈希 / 已导入的文本块 id
+MANIFEST_PATH = os.path.join(CHROMA_PATH, f"ingest_manifest_{collection_name_for(RAG_EMBEDDING_BACKEND)}.json")
+_manifest_lock = threading.Lock()
+
+def _load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"导入清单读取失败，将全量重建: {e}")
+        return {}
+
+def _save_manifest(manifest: dict):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def chunk_id(source: str, text: str) -> str:
+    """基于来源与内容的稳定 id：内容不变则 id 不变"""
+    return hashlib.sha256(f"{source}\n{text}".encode('utf-8')).hexdigest()[:32]
+
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _remove_legacy_ids():
+    """清理旧版按位置编号 (doc_{i}) 写入的文本块，它们会被不同文件互相覆盖"""
+    try:
+        legacy = [i for i in collection.get(include=[])["ids"] if i.startswith("doc_")]
+        if legacy:
+            collection.delete(ids=legacy)
+            print(f"已清理 {len(legacy)} 个旧版文本块")
+    except Exception as e:
+        print(f"清理旧版文本块失败: {e}")
+
+def _record_status(source: str, state: str, **fields):
+    with _status_lock:
+        _ingest_status[source] = {"state": state, "updated_at": time.time(), **fields}
+
+def ingest_knowledge_base(file_path: str, force: bool = False, source: Optional[str] = None):
     """
-    读取文本文件，分割成块并存储到向量数据库
+    增量导入文本文件：mtime 与内容哈希均未变化时跳过；
+    只写入新增/修改的文本块，删除源文件中已消失的文本块。
+    source 为写入清单与元数据的来源名，默认即 file_path。
     """
     if not collection:
         print("知识库未初始化，跳过导入")
         return
+    source = source or file_path
         
-    print(f"导入知识库: {file_path}")
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        
-        # 按段落分割
-        chunks = [c.strip() for c in text.split('\n\n') if c.strip()]
-        
-        if not chunks:
-            print("没有找到有效内容")
-            return
-        
-        ids = [f"doc_{i}" for i in range(len(chunks))]
-        
-        # 检查是否已经存在
-        existing = collection.count()
-        if existing > 0:
-            print(f"知识库已有 {existing} 条记录，将更新...")
-        
-        collection.upsert(
-            documents=chunks,
-            ids=ids,
-            metadatas=[{"source": file_path} for _ in chunks]
-        )
-        print(f" 成功导入 {len(chunks)} 个文档块")
+        with _manifest_lock:
+            manifest = _load_manifest()
+            if not manifest:
+                _remove_legacy_ids()
+            entry = manifest.get(source, {})
+
+            mtime = os.path.getmtime(file_path)
+            # 切分规则升级后需要按新规则重建该文件
+            if entry.get("chunker") != CHUNKER_VERSION:
+                force = True
+            if not force and entry.get("mtime") == mtime:
+                print(f"知识库文件未变化，跳过: {source}")
+                _record_status(source, "ok", chunks=len(entry.get("chunk_ids", [])))
+                return
+
+            file_hash = _file_sha256(file_path)
+            if not force and entry.get("sha256") == file_hash:
+                entry["mtime"] = mtime
+                manifest[source] = entry
+                _save_manifest(manifest)
+                print(f"知识库文件内容未变化，跳过: {source}")
+                _record_status(source, "ok", chunks=len(entry.get("chunk_ids", [])))
+                return
+
+            print(f"导入知识库: {source}")
+            _record_status(source, "ingesting")
+            chunks = {}
+            for chunk in chunk_file(file_path, source=source):
+                chunks.setdefault(chunk_id(source, chunk.text), chunk)
+            ids = list(chunks)
+
+            old_ids = set(entry.get("chunk_ids", []))
+            new_pairs = [(i, c) for i, c in chunks.items() if force or i not in old_ids]
+            removed = sorted(old_ids - set(ids))
+
+            if removed:
+                collection.delete(ids=removed)
+                for doc_id in removed:
+                    bm25_index.remove(doc_id)
+            if new_pairs:
+                # 导入时的嵌入落盘缓存，未变化的文本块下次不再重复计费
+                with embedding_persisting():
+                    collection.upsert(
+                        documents=[c.text for _, c in new_pairs],
+                        ids=[i for i, _ in new_pairs],
+                        metadatas=[c.metadata for _, c in new_pairs]
+                    )
+                for doc_id, chunk in new_pairs:
+                    bm25_index.add(doc_id, chunk.text, chunk.metadata)
+            if removed or new_pairs:
+                _bump_kb_version()
+
+            manifest[source] = {"mtime": mtime, "sha256": file_hash, "chunker": CHUNKER_VERSION, "chunk_ids": ids}
+            _save_manifest(manifest)
+            print(f" 导入完成: 新增/更新 {len(new_pairs)} 块，删除 {len(removed)} 块，共 {len(ids)} 块")
+            _record_status(source, "ok", chunks=len(ids), added=len(new_pairs), removed=len(removed))
         
     except Exception as e:
         print(f"导入知识库失败: {e}")
+        _record_status(source, "error", error=str(e))
 
-def search_knowledge(query: str, n_results: int = 3):
+def remove_knowledge_source(source: str):
+    """源文件已删除：移除其全部文本块与清单记录"""
+    if not collection:
+        return
+    try:
+        with _manifest_lock:
+            manifest = _load_manifest()
+            entry = manifest.pop(source, None)
+            if entry is None:
+                return
+            ids = entry.get("chunk_ids", [])
+            if ids:
+                collection.delete(ids=ids)
+                for doc_id in ids:
+                    bm25_index.remove(doc_id)
+                _bump_kb_version()
+            _save_manifest(manifest)
+        with _status_lock:
+            _ingest_status.pop(source, None)
+        print(f"知识库文件已删除，移除 {len(ids)} 块: {source}")
+    except Exception as e:
+        print(f"移除知识库文件失败: {e}")
+        _record_status(source, "error", error=str(e))
+
+def _ensure_bm25_index():
+    """首次使用时从集合全量加载词法索引，之后随导入增量维护"""
+    global _bm25_loaded
+    if _bm25_loaded or not collection:
+        return
+    with _bm25_load_lock:
+        if _bm25_loaded:
+            return
+        try:
+            data = collection.get(include=["documents", "metadatas"])
+            metadatas = data.get("metadatas") or [None] * len(data["ids"])
+            for doc_id, doc, metadata in zip(data["ids"], data["documents"], metadatas):
+                bm25_index.add(doc_id, doc, metadata)
+            _bm25_loaded = True
+            print(f"BM25 索引构建完成: {len(bm25_index)} 个文本块")
+        except Exception as e:
+            print(f"BM25 索引构建失败: {e}")
+
+def _build_filters(city: Optional[str], topic: Optional[str]):
+    """
+    把城市/主题过滤条件转换为 Chroma where 子句与 BM25 文档过滤函数。
+    按城市过滤时同时保留通用内容（city 为空的文本块）。
+    """
+    conditions, checks = [], []
+    if city:
+        cities = [normalize_city(city), ""]
+        conditions.append({"city": {"$in": cities}})
+        checks.append(lambda metadata: metadata.get("city", "") in cities)
+    if topic:
+        conditions.append({f"topic_{topic}": True})
+        checks.append(lambda metadata: metadata.get(f"topic_{topic}") is True)
+    if not conditions:
+        return None, None
+    where = conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def doc_filter(metadata: dict) -> bool:
+        return all(check(metadata) for check in checks)
+
+    return where, doc_filter
+
+def _search_uncached(query: str, n_results: int, city: Optional[str] = None, topic: Optional[str] = None):
+    """
+    混合检索：BM25（字符二元组）+ 向量检索，倒数排名融合。
+    城市/主题过滤同时下推到 Chroma where 子句与 BM25 候选集。
+    短关键词查询若有足够多文本块原样命中，直接返回词法结果，不做嵌入计算。
+    """
+    where, doc_filter = _build_filters(city, topic)
+    lexical_ids = [doc_id for doc_id, _ in bm25_index.search(query, HYBRID_CANDIDATES, doc_filter)]
+
+    # 精确关键词快速路径（如“西湖”“宽窄巷子”）
+    keyword = normalize_text(query)
+    if keyword and " " not in keyword and len(keyword) <= EXACT_MATCH_MAX_LEN:
+        exact_ids = [i for i in lexical_ids if bm25_index.contains_phrase(i, keyword)]
+        if len(exact_ids) >= n_results:
+            return [bm25_index.get(i) for i in exact_ids[:n_results]]
+
+    # 向量检索
+    vector_ids, docs_by_id = [], {}
+    try:
+        candidates = min(HYBRID_CANDIDATES, collection.count())
+        if candidates > 0:
+            results = collection.query(query_texts=[query], n_results=candidates, where=where)
+            vector_ids = results['ids'][0]
+            docs_by_id = dict(zip(vector_ids, results['documents'][0]))
+    except Exception as e:
+        print(f"向量检索失败，仅使用词法检索: {e}")
+
+    fused = reciprocal_rank_fusion([vector_ids, lexical_ids])[:n_results]
+    docs = [docs_by_id.get(i) or bm25_index.get(i) for i in fused]
+    docs = [d for d in docs if d]
+    
+    # 如果没有找到结果，返回空列表
+    if not docs:
+        print(f"知识库中未找到关于 '{query}' 的信息")
+        return []
+        
+    print(f"找到 {len(docs)} 条相关文档")
+    return docs
+
+def search_knowledge(query: str, n_results: int = 3, city: Optional[str] = None, topic: Optional[str] = None):
     """
-    在知识库中进行语义搜索
+    在知识库中检索（带结果缓存）。
+    city / topic 可选，只在对应城市、主题（见 chunker.TOPIC_KEYWORDS）的文本块中检索；
+    主题过滤后没有结果时退回不限主题检索。
+    缓存键包含知识库版本号，每次导入产生变更后旧结果自动失效。
     """
     if not collection:
         print("知识库未初始化，返回空结果")
         return []
-    
+
+    if topic and topic not in TOPIC_KEYWORDS:
+        print(f"未知的知识库主题: {topic}，忽略主题过滤")
+        topic = None
+    cache_key = (_kb_version, normalize_text(query), n_results, normalize_city(city) if city else None, topic)
+    cached = search_cache.get(cache_key)
+    if cached is not MISSING:
+        return list(cached)
+
+    _ensure_bm25_index()
     try:
-        # 先尝试语义搜索
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
-        
-        docs = results.get('documents', [[]])[0] if results else []
-        
-        # 如果没有找到结果，返回空列表
-        if not docs:
-            print(f"知识库中未找到关于 '{query}' 的信息")
-            return []
-            
-        print(f"找到 {len(docs)} 条相关文档")
-        return docs[:n_results]
-        
+        docs = _search_uncached(query, n_results, city, topic)
+        if not docs and topic:
+            # 主题标记靠关键词，覆盖不全：该主题下没有命中时退回不限主题检索
+            print(f"主题 {topic} 下未找到结果，改为不限主题检索")
+            docs = _search_uncached(query, n_results, city)
     except Exception as e:
         print(f"知识库搜索失败: {e}")
         return []
 
-def init_knowledge_base():
-    """初始化知识库"""
+    search_cache.set(cache_key, tuple(docs))
+    return docs
+
+def get_search_cache_stats():
+    """检索结果缓存的命中统计"""
+    return {**search_cache.stats(), "kb_version": _kb_version}
+
+def _bump_kb_version():
+    """知识库内容变化：递增版本号并清空检索缓存"""
+    global _kb_version
+    _kb_version += 1
+    search_cache.clear()
+
+def _source_name(file_path: str) -> str:
+    """清单中的来源名：相对 backend 目录的路径（与旧版 "knowledge_base/xxx.txt" 保持一致）"""
+    return os.path.relpath(file_path, BASE_DIR).replace(os.sep, "/")
+
+def discover_knowledge_files() -> dict:
+    """扫描知识库目录，返回 {来源名: (绝对路径, mtime, 大小)}"""
+    files = {}
+    for root, dirs, names in os.walk(KNOWLEDGE_BASE_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if name.startswith(".") or not name.lower().endswith(KNOWLEDGE_FILE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # 扫描期间被删除
+            files[_source_name(path)] = (path, stat.st_mtime, stat.st_size)
+    return files
+
+def sync_knowledge_base():
+    """把知识库目录同步到向量库：导入新增/修改的文件，移除已删除的文件"""
+    global _last_sync
     if not collection:
         print("知识库未初始化，跳过导入")
         return
-        
-    knowledge_files = [
-        "knowledge_base/secret_guide.txt",
-        "knowledge_base/travel_tips.txt"
-    ]
-    
-    for file_path in knowledge_files:
-        if os.path.exists(file_path):
-            try:
-                ingest_knowledge_base(file_path)
-            except Exception as e:
-                print(f"导入 {file_path} 失败: {e}")
-        else:
-            print(f"知识库文件不存在: {file_path}")
 
-# 启动时初始化
-init_knowledge_base()
+    with _sync_lock:
+        _ensure_bm25_index()
+        files = discover_knowledge_files()
+        for source, (path, _, _) in sorted(files.items()):
+            ingest_knowledge_base(path, source=source)
+        for source in set(_load_manifest()) - set(files):
+            remove_knowledge_source(source)
+        _last_sync = time.time()
+
+def init_knowledge_base():
+    """初始化知识库"""
+    sync_knowledge_base()
+
+async def watch_knowledge_base(interval: float = KB_WATCH_INTERVAL, debounce: float = KB_WATCH_DEBOUNCE):
+    """
+    后台轮询知识库目录：启动时先全量同步，之后文件有变化且在 debounce 秒内
+    不再变化时才重新同步（只有改动过的文件会真正导入）。同步在线程池中执行，不阻塞请求处理。
+    interval <= 0 时只做启动同步。
+    """
+    loop = asyncio.get_running_loop()
+
+    def snapshot():
+        return {source: (mtime, size) for source, (_, mtime, size) in discover_knowledge_files().items()}
+
+    synced = None
+    try:
+        await loop.run_in_executor(None, sync_knowledge_base)
+        synced = await loop.run_in_executor(None, snapshot)
+    except Exception as e:
+        # 启动同步失败不终止监听：synced 为 None，下一轮轮询会重试全量同步
+        import traceback
+        traceback.print_exc()
+        print(f"❌ 知识库启动同步失败: {e}")
+    if interval <= 0:
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = await loop.run_in_executor(None, snapshot)
+            if current == synced:
+                continue
+            # 去抖：等待编辑器/拷贝写完，快照稳定后再导入
+            while True:
+                await asyncio.sleep(debounce)
+                latest = await loop.run_in_executor(None, snapshot)
+                if latest == current:
+                    break
+                current = latest
+            print("检测到知识库文件变化，开始增量导入")
+            await loop.run_in_executor(None, sync_knowledge_base)
+            synced = current
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"知识库目录监听出错: {e}")
+
+def get_knowledge_status():
+    """知识库导入状态：各文件的块数与最近一次导入结果"""
+    manifest = _load_manifest()
+    with _status_lock:
+        status = dict(_ingest_status)
+    files = []
+    for source in sorted(set(manifest) | set(status)):
+        entry = manifest.get(source, {})
+        file_status = dict(status.get(source, {"state": "pending"}))
+        if "error" in file_status:
+            # 异常信息里可能带服务器上的绝对路径
+            file_status["error"] = file_status["error"].replace(BASE_DIR + os.sep, "")
+        files.append({
+            "source": source,
+            "chunks": len(entry.get("chunk_ids", [])),
+            "mtime": entry.get("mtime"),
+            "chunker": entry.get("chunker"),
+            **file_status,
+        })
+    try:
+        total_chunks = collection.count() if collection else 0
+    except Exception:
+        total_chunks = None
+    return {
+        "directory": _source_name(KNOWLEDGE_BASE_DIR),  # 相对 backend 目录，不暴露服务器绝对路径
+        "collection": collection_name_for(RAG_EMBEDDING_BACKEND),
+        "total_chunks": total_chunks,
+        "bm25_documents": len(bm25_index),
+        "kb_version": _kb_version,
+        "last_sync": _last_sync,
+        "files": files,
+    }
@@ -1,10 +1,15 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 import requests
 import json
 from datetime import datetime
+from sqlalchemy.orm import Session
+from cache_utils import LRUCache
+from chat_memory import CHAT_HOT_SESSIONS, CHAT_HOT_MESSAGES, build_chat_messages, chat_memory
+from database import User, get_db
+from auth import get_optional_user
 
 app = FastAPI(title="WanderAI API 服务")
 
@@ -27,8 +32,9 @@ class Message(BaseModel):
     role: str
     content: str
 
-# 对话历史存储（内存）
-conversation_history = {}
+# 登录用户的对话历史持久化到数据库（chat_memory）；匿名会话没有归属用户，
+# 只保存在进程内存：只保留最近活跃的会话，每个会话保留最近若干条消息
+conversation_history = LRUCache(maxsize=CHAT_HOT_SESSIONS)
 
 def call_dashscope_api(message: str, api_key: str, history: List[Message] = None) -> str:
     """调用阿里云DashScope API"""
@@ -36,8 +42,6 @@ def call_dashscope_api(message: str, api_key: str, history: List[Message] = None
         print(f"正在调用DashScope API，消息长度: {len(message)}")
         
         # 构建请求数据
-        messages = []
-        
         # 系统提示词
         system_prompt = """你是一个专业的旅行规划助手WanderAI。你的特点是：
 1. 热情、专业、乐于助人
@@ -49,15 +53,12 @@ def call_dashscope_api(message: str, api_key: str, history: List[Message] = None
 
 请用中文回答，保持自然对话风格。"""
         
-        messages.append({"role": "system", "content": system_prompt})
-        
-        # 添加历史对话
-        if history:
-            for msg in history[-10:]:  # 最多保留10条历史
-                messages.append({"role": msg.role, "content": msg.content})
-        
-        # 添加当前消息
-        messages.append({"role": "user", "content": message})
+        # 历史对话在 token 预算内保留原文，更早的轮次压缩为摘要
+        messages = build_chat_messages(
+            system_prompt,
+            [{"role": msg.role, "content": msg.content} for msg in history or []],
+            message
+        )
         
         # API请求数据
         data = {
@@ -161,7 +162,11 @@ async def root():
     }
 
 @app.post("/api/chat")
-async def chat_with_ai(request_data: ChatRequest):
+async def chat_with_ai(
+    request_data: ChatRequest,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: Session = Depends(get_db)
+):
     """AI对话接口 - 调用真实大模型"""
     print(f"\n=== 收到聊天请求 ===")
     print(f"消息: {request_data.message}")
@@ -180,10 +185,10 @@ async def chat_with_ai(request_data: ChatRequest):
         
         # 获取对话历史
         session_id = request_data.session_id
-        if session_id not in conversation_history:
-            conversation_history[session_id] = []
-        
-        history = conversation_history[session_id]
+        if current_user:
+            history = [Message(**msg) for msg in chat_memory.load(db, current_user.id, session_id)]
+        else:
+            history = conversation_history.get(session_id, [])
         
         # 调用大模型API
         ai_reply = call_dashscope_api(
@@ -192,13 +197,15 @@ async def chat_with_ai(request_data: ChatRequest):
             history=history
         )
         
-        # 保存到历史
-        history.append(Message(role="user", content=request_data.message))
-        history.append(Message(role="assistant", content=ai_reply))
-        
-        # 限制历史长度（最多20条消息）
-        if len(history) > 20:
-            conversation_history[session_id] = history[-20:]
+        # 保存到历史（限制长度）
+        if current_user:
+            chat_memory.append(db, current_user.id, session_id, request_data.message, ai_reply)
+        else:
+            history = history + [
+                Message(role="user", content=request_data.message),
+                Message(role="assistant", content=ai_reply)
+            ]
+            conversation_history.set(session_id, history[-CHAT_HOT_MESSAGES:])
         
         print(f"AI回复长度: {len(ai_reply)}")
         
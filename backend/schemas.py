@@ -0,0 +1,25 @@
+# backend/schemas.py
+"""
+不依赖 FastAPI 应用的共享请求模型，供 main.py 与离线脚本（如 warm_plan_cache.py）共同使用。
+"""
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+
+
+class GeneratePlanRequest(BaseModel):
+    """行程生成请求模型"""
+    origin: str = "当前城市"
+    destination: str
+    days: int = 3
+    people: int = 2
+    budget: str = "适中"
+    transport: str = "公共交通"
+    pace: str = "适中"
+    who_with: str = "朋友"
+    tags: List[str] = []
+    preferences: str = "无特殊偏好"
+    api_config: Dict[str, Any] = {}
+
+    class Config:
+        extra = "ignore"  # 忽略额外字段
@@ -0,0 +1,143 @@
+# backend/semantic_cache.py
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from local_embedding import HashingNgramEmbedding, normalize_text
+
+# 相似度阈值、内容字符重合度下限、有效期与条数上限
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.85))
+SEMANTIC_CACHE_MIN_OVERLAP = float(os.getenv("SEMANTIC_CACHE_MIN_OVERLAP", 0.8))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 6 * 3600))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 1000))
+
+# 口语填充词：不改变问题含义，比较前去掉（“北京有什么好玩的” ≈ “北京好玩的地方”）
+FILLER_PHRASES = ("请问", "帮我", "给我", "推荐一下", "推荐", "一下", "我想", "想要",
+                  "有什么", "有啥", "什么", "哪些", "哪里", "哪儿", "的地方", "地方",
+                  "可以", "吗", "呢", "啊", "吧", "呀", "的", "了")
+_DIGITS = re.compile(r"\d+")
+
+
+def content_text(text: str) -> str:
+    """去掉标点与填充词后的问题主干"""
+    text = normalize_text(text)
+    for phrase in FILLER_PHRASES:
+        text = text.replace(phrase, "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _overlap(a: str, b: str) -> float:
+    chars_a, chars_b = set(a.replace(" ", "")), set(b.replace(" ", ""))
+    union = chars_a | chars_b
+    return len(chars_a & chars_b) / len(union) if union else 1.0
+
+
+class SemanticCache:
+    """
+    进程内语义缓存：问题主干用本地嵌入向量化，余弦相似度超过阈值即复用历史回答。
+    为避免“北京/上海”“3天/5天”这类只差一个关键字的误命中，额外要求
+    数字完全一致、主干字符重合度不低于 min_overlap。
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 min_overlap: float = SEMANTIC_CACHE_MIN_OVERLAP,
+                 ttl: int = SEMANTIC_CACHE_TTL, maxsize: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._embedder = HashingNgramEmbedding()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # 主干 -> 条目（按最近使用排序）
+        self._matrix: Optional[np.ndarray] = None  # 与 _entries 顺序一致的向量矩阵，变更后惰性重建
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0  # 相似度达标但被关键字校验拦下
+        self.similarity_sum = 0.0
+
+    def _evict(self):
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        if expired:
+            self._matrix = None
+
+    def get(self, message: str) -> Optional[Dict[str, Any]]:
+        """命中时返回 {"reply", "similarity", "matched"}，否则 None"""
+        content = content_text(message)
+        if not content:
+            return None
+        vector = self._embedder.embed_one(content)
+        with self._lock:
+            self.lookups += 1
+            self._evict()
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([entry["vector"] for entry in self._entries.values()])
+            scores = self._matrix @ vector
+            keys = list(self._entries)
+            digits = _DIGITS.findall(content)
+            for index in np.argsort(-scores):
+                similarity = float(scores[index])
+                if similarity < self.threshold:
+                    break
+                key = keys[index]
+                if _DIGITS.findall(key) != digits or _overlap(key, content) < self.min_overlap:
+                    self.rejected += 1
+                    continue
+                entry = self._entries[key]
+                entry["hits"] += 1
+                self._entries.move_to_end(key)
+                self._matrix = None
+                self.hits += 1
+                self.similarity_sum += similarity
+                return {"reply": entry["reply"], "similarity": round(similarity, 4), "matched": entry["message"]}
+        return None
+
+    def set(self, message: str, reply: str):
+        content = content_text(message)
+        if not content or not reply:
+            return
+        vector = self._embedder.embed_one(content)
+        with self._lock:
+            self._entries[content] = {
+                "message": message,
+                "reply": reply,
+                "vector": vector,
+                "hits": 0,
+                "expires_at": time.time() + self.ttl,
+            }
+            self._entries.move_to_end(content)
+            self._matrix = None
+            self._evict()
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            popular = sorted(self._entries.items(), key=lambda item: item[1]["hits"], reverse=True)[:top]
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "rejected": self.rejected,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "avg_hit_similarity": round(self.similarity_sum / self.hits, 4) if self.hits else None,
+                "threshold": self.threshold,
+                # 只暴露问题主干的摘要哈希，不返回任何用户消息原文
+                "top_entries": [{"hash": hashlib.sha256(key.encode("utf-8")).hexdigest()[:16], "hits": entry["hits"]}
+                                for key, entry in popular if entry["hits"]],
+            }
+
+
+chat_cache = SemanticCache()
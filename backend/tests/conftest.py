@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块是平铺的，测试里直接按模块名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,104 @@
+"""user_stats 增量维护与全量重建结果一致性"""
+import math
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+
+from database import Base, SessionLocal, Trip, User, UserStats
+from user_stats import COUNTER_FIELDS, SUM_FIELDS, get_user_stats, rebuild_user_stats, stats_to_dict
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal(bind=engine)
+    session.add(User(id=1, username="tester", email="tester@example.com", password_hash="x"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _incremental(db):
+    db.expire_all()
+    return stats_to_dict(db.get(UserStats, 1))
+
+
+def _rebuilt(db):
+    rebuild_user_stats(db, 1)
+    db.expire_all()
+    return stats_to_dict(db.get(UserStats, 1))
+
+
+def _assert_same(incremental, rebuilt):
+    for name in SUM_FIELDS:
+        assert math.isclose(incremental[name], rebuilt[name], abs_tol=1e-6), name
+    for name in COUNTER_FIELDS:
+        assert incremental[name] == rebuilt[name], name
+
+
+def test_omitted_fields_use_column_defaults(db):
+    # 一次 flush 批量插入：days/people/budget/status/tags 都不传，走列默认值
+    db.add_all([
+        Trip(user_id=1, name="a", destination="杭州"),
+        Trip(user_id=1, name="b", destination="成都", start_date=datetime(2030, 5, 1)),
+        Trip(user_id=1, name="c", destination="杭州", days=5, people=None, budget=None),
+        Trip(user_id=1, name="d", destination="厦门", days=4, people=3, budget=2400.0,
+             tags=["美食"], status="completed", latitude=24.48, longitude=118.09),
+    ])
+    db.commit()
+
+    incremental = _incremental(db)
+    assert incremental["total_days"] == 3 + 3 + 5 + 4
+    assert incremental["budget_counts"] == {"经济": 3, "适中": 1}
+    _assert_same(incremental, _rebuilt(db))
+
+
+def test_update_and_delete_match_rebuild(db):
+    trips = [Trip(user_id=1, name=str(i), destination=city) for i, city in enumerate(["北京", "上海", "北京"])]
+    db.add_all(trips)
+    db.commit()
+
+    trips[0].days = 7
+    trips[0].status = "completed"
+    trips[1].tags = ["文化"]
+    db.delete(trips[2])
+    db.commit()
+
+    _assert_same(_incremental(db), _rebuilt(db))
+
+
+def test_interleaved_sessions_do_not_lose_updates(db):
+    db.add(Trip(user_id=1, name="seed", destination="上海"))
+    db.commit()
+    other = SessionLocal(bind=db.get_bind())
+    try:
+        # 两个会话都先读到同一份统计行（保持引用，留在 identity map 中），再各自新增行程
+        loaded = [db.get(UserStats, 1), other.get(UserStats, 1)]
+        db.add(Trip(user_id=1, name="a", destination="北京", tags=["美食"]))
+        other.add(Trip(user_id=1, name="b", destination="北京", tags=["美食"]))
+        db.commit()
+        other.commit()
+        assert all(stats.total_trips == 3 for stats in loaded)
+    finally:
+        other.close()
+
+    incremental = _incremental(db)
+    assert incremental["total_trips"] == 3
+    assert incremental["city_counts"] == {"上海": 1, "北京": 2}
+    assert incremental["tag_counts"] == {"美食": 2}
+    _assert_same(incremental, _rebuilt(db))
+
+
+def test_get_user_stats_does_not_write(db):
+    db.add(Trip(user_id=1, name="a", destination="西安"))
+    db.commit()
+    # 模拟功能上线前的老用户：没有统计行
+    db.query(UserStats).delete()
+    db.commit()
+
+    assert get_user_stats(db, 1).total_trips == 1
+    db.rollback()
+    assert db.get(UserStats, 1) is None
@@ -1,10 +1,61 @@
 import os
+from typing import Optional
 import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
 
 AMAP_KEY = os.getenv("AMAP_API_KEY")
+AMAP_BASE_URL = os.getenv("AMAP_BASE_URL", "https://restapi.amap.com/v3")
+
+# Connection pool settings for the shared client
+AMAP_POOL_MAX_CONNECTIONS = int(os.getenv("AMAP_POOL_MAX_CONNECTIONS", 50))
+AMAP_POOL_MAX_KEEPALIVE = int(os.getenv("AMAP_POOL_MAX_KEEPALIVE", 20))
+AMAP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("AMAP_POOL_KEEPALIVE_EXPIRY", 30))
+AMAP_TOOL_TIMEOUT = float(os.getenv("AMAP_TOOL_TIMEOUT", 5))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the module-level AsyncClient, creating it lazily.
+    HTTP/2 is negotiated via ALPN when the server supports it.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_http2_available(),
+            timeout=httpx.Timeout(AMAP_TOOL_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=AMAP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=AMAP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=AMAP_POOL_KEEPALIVE_EXPIRY
+            )
+        )
+    return _client
+
+
+async def init_client():
+    """Open the shared client (FastAPI startup)."""
+    get_client()
+
+
+async def close_client():
+    """Close the shared client and its pooled connections (FastAPI shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
 async def search_poi(keywords: str, city: str = "", api_key: str = None):
     """
@@ -13,7 +64,7 @@ async def search_poi(keywords: str, city: str = "", api_key: str = None):
     # Use passed key if available, else default
     key_to_use = api_key if api_key else AMAP_KEY
     
-    url = "https://restapi.amap.com/v3/place/text"
+    url = f"{AMAP_BASE_URL}/place/text"
     params = {
         "key": key_to_use,
         "keywords": keywords,
@@ -23,26 +74,25 @@ async def search_poi(keywords: str, city: str = "", api_key: str = None):
         "extensions": "all"
     }
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, params=params)
-            data = response.json()
-            if data["status"] == "1" and int(data["count"]) > 0:
-                results = []
-                for poi in data["pois"]:
-                    results.append({
-                        "name": poi["name"],
-                        "address": poi["address"],
-                        "location": poi["location"], # lng,lat
-                        "type": poi["type"],
-                        "tel": poi.get("tel", "N/A")
-                    })
-                return results
-            else:
-                return []
-        except Exception as e:
-            print(f"Error calling Amap API: {e}")
+    try:
+        response = await get_client().get(url, params=params)
+        data = response.json()
+        if data["status"] == "1" and int(data["count"]) > 0:
+            results = []
+            for poi in data["pois"]:
+                results.append({
+                    "name": poi["name"],
+                    "address": poi["address"],
+                    "location": poi["location"], # lng,lat
+                    "type": poi["type"],
+                    "tel": poi.get("tel", "N/A")
+                })
+            return results
+        else:
             return []
+    except Exception as e:
+        print(f"Error calling Amap API: {e}")
+        return []
 
 async def search_nearby(location: str, keywords: str = "", radius: int = 1000, api_key: str = None):
     """
@@ -52,7 +102,7 @@ async def search_nearby(location: str, keywords: str = "", radius: int = 1000, a
     # Use passed key if available, else default
     key_to_use = api_key if api_key else AMAP_KEY
     
-    url = "https://restapi.amap.com/v3/place/around"
+    url = f"{AMAP_BASE_URL}/place/around"
     params = {
         "key": key_to_use,
         "location": location,
@@ -63,23 +113,22 @@ async def search_nearby(location: str, keywords: str = "", radius: int = 1000, a
         "extensions": "all"
     }
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, params=params)
-            data = response.json()
-            if data["status"] == "1" and int(data["count"]) > 0:
-                results = []
-                for poi in data["pois"]:
-                    results.append({
-                        "name": poi["name"],
-                        "address": poi["address"],
-                        "location": poi["location"],
-                        "type": poi["type"],
-                        "distance": poi.get("distance", 0)
-                    })
-                return results
-            else:
-                return []
-        except Exception as e:
-            print(f"Error calling Amap Nearby API: {e}")
+    try:
+        response = await get_client().get(url, params=params)
+        data = response.json()
+        if data["status"] == "1" and int(data["count"]) > 0:
+            results = []
+            for poi in data["pois"]:
+                results.append({
+                    "name": poi["name"],
+                    "address": poi["address"],
+                    "location": poi["location"],
+                    "type": poi["type"],
+                    "distance": poi.get("distance", 0)
+                })
+            return results
+        else:
             return []
+    except Exception as e:
+        print(f"Error calling Amap Nearby API: {e}")
+        return []
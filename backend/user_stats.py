@@ -0,0 +1,273 @@
+# backend/user_stats.py
+"""
+用户统计物化表 (user_stats) 的增量维护。
+
+每个行程对统计的“贡献”由 trip_contribution 计算；会话 flush 前
+新增行程加上贡献、删除行程减去贡献、修改行程先减旧值再加新值，
+净变化量以 SQL 原子加减写入，与行程写入在同一事务内提交。全量计算走 analytics 的列式向量化路径。浮点累加或绕过 ORM 的写入造成的偏差
+可用 `python user_stats.py --rebuild` 全量重建修复。
+"""
+import argparse
+import math
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, event, func, insert, inspect, literal_column, update
+from sqlalchemy.orm import Session
+
+from analytics import (HOME_LAT, HOME_LON, SEASONS, STAT_FIELDS, aggregate_trip_columns,
+                       budget_level, load_trip_columns)
+from database import SessionLocal, Trip, User, UserStats
+
+COUNTER_FIELDS = ("city_counts", "tag_counts", "month_counts", "season_counts", "budget_counts")
+SUM_FIELDS = ("total_trips", "completed_trips", "total_spent", "total_budget", "total_days",
+              "total_people", "lead_time_sum", "lead_time_count", "cpppd_sum", "cpppd_count",
+              "distance_sum")
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """计算两点间的大圆距离 (km)"""
+    if not lat1 or not lon1 or not lat2 or not lon2:
+        return 0
+    R = 6371  # 地球半径
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) * math.sin(d_lat / 2) +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(d_lon / 2) * math.sin(d_lon / 2))
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def _as_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for fmt in ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f"):
+            try:
+                return datetime.strptime(value, fmt).date()
+            except ValueError:
+                continue
+    return None
+
+
+def trip_contribution(values: Dict[str, Any]) -> Dict[str, Any]:
+    """单个行程对用户统计的贡献（values 为 STAT_FIELDS 的取值）"""
+    days = values.get("days") or 0
+    people = values.get("people") or 0
+    budget = values.get("budget")
+    actual_cost = values.get("actual_cost")
+    start = _as_date(values.get("start_date"))
+
+    contribution = {
+        "total_trips": 1,
+        "completed_trips": 1 if values.get("status") == "completed" else 0,
+        "total_spent": float(actual_cost if actual_cost is not None else (budget or 0)),
+        "total_budget": float(budget or 0),
+        "total_days": days,
+        "total_people": people or 1,
+        "lead_time_sum": 0.0,
+        "lead_time_count": 0,
+        "cpppd_sum": 0.0,
+        "cpppd_count": 0,
+        "distance_sum": haversine_distance(HOME_LAT, HOME_LON, values.get("latitude"), values.get("longitude")) * 2,
+        "city_counts": {},
+        "tag_counts": {},
+        "month_counts": {},
+        "season_counts": {},
+        "budget_counts": {budget_level(budget): 1},
+    }
+    if values.get("destination"):
+        contribution["city_counts"][values["destination"]] = 1
+    tags = values.get("tags")
+    if isinstance(tags, list):
+        for tag in tags:
+            contribution["tag_counts"][tag] = contribution["tag_counts"].get(tag, 0) + 1
+    if start:
+        created = _as_date(values.get("created_at")) or datetime.utcnow().date()
+        contribution["lead_time_sum"] = float(max(0, (start - created).days))
+        contribution["lead_time_count"] = 1
+        contribution["month_counts"][start.strftime("%Y-%m")] = 1
+        contribution["season_counts"][SEASONS[start.strftime("%m")]] = 1
+    if days > 0 and people > 0:
+        contribution["cpppd_sum"] = (budget or 0) / (days * people)
+        contribution["cpppd_count"] = 1
+    return contribution
+
+
+def _pending_trip_values(trip: Trip) -> Dict[str, Any]:
+    """
+    新增行程的统计字段。before_flush 时列默认值（days=3、budget=0.0 等）还没填上，
+    这里按 INSERT 的规则（值为 None 且列有默认值时取默认值）先补齐，保证与实际入库的值、
+    以及全量重建的结果一致。
+    """
+    for name in STAT_FIELDS:
+        default = Trip.__table__.c[name].default
+        if getattr(trip, name) is None and default is not None:
+            setattr(trip, name, default.arg(None) if default.is_callable else default.arg)
+    return {name: getattr(trip, name) for name in STAT_FIELDS}
+
+
+def _empty_delta() -> Dict[str, Any]:
+    return {**{name: 0 for name in SUM_FIELDS}, **{name: {} for name in COUNTER_FIELDS}}
+
+
+def _merge_delta(delta: Dict[str, Any], contribution: Dict[str, Any], sign: int):
+    """把一个行程的贡献并入某用户本次 flush 的净变化量（计数可为负，不做截断）"""
+    for name in SUM_FIELDS:
+        delta[name] += sign * contribution[name]
+    for name in COUNTER_FIELDS:
+        counter = delta[name]
+        for key, count in contribution[name].items():
+            counter[key] = counter.get(key, 0) + sign * count
+
+
+def _json_path(key: str) -> str:
+    return '$."' + str(key).replace('"', '\\"') + '"'
+
+
+def _insert_or_ignore():
+    return insert(UserStats.__table__).prefix_with("OR IGNORE")
+
+
+def _ensure_stats_row(session: Session, user_id: int):
+    """
+    统计行不存在（如功能上线前的老用户）时，以数据库中现有行程为基线插入。
+    用 INSERT OR IGNORE：并发的首次写入不会主键冲突，后到者的基线被忽略、只叠加自己的增量。
+    """
+    if session.query(UserStats.user_id).filter(UserStats.user_id == user_id).first() is None:
+        baseline = aggregate_trip_columns(load_trip_columns(session, user_id))
+        session.execute(_insert_or_ignore().values(user_id=user_id, **baseline))
+
+
+def _increment_stats(session: Session, user_id: int, delta: Dict[str, Any]):
+    """
+    在 SQL 里做 col = col + :delta（JSON 计数用 json_set / json_remove 逐键加减），
+    读改写都发生在数据库写锁内，并发写入同一用户的行程不会互相覆盖。
+    """
+    table = UserStats.__table__
+    where = table.c.user_id == user_id
+    session.execute(update(table).where(where).values({
+        name: func.coalesce(table.c[name], 0) + delta[name] for name in SUM_FIELDS
+    }))
+    for name in COUNTER_FIELDS:
+        column = table.c[name]
+        base = func.coalesce(column, literal_column("'{}'"))
+        for key, count in delta[name].items():
+            if not count:
+                continue
+            path = _json_path(key)
+            current = func.coalesce(func.json_extract(column, path), 0) + count
+            session.execute(update(table).where(where).values({
+                name: case((current > 0, func.json_set(base, path, current)),
+                           else_=func.json_remove(base, path))
+            }))
+    # 会话里已加载的统计行已过期，下次访问时重新读取
+    stats = session.identity_map.get(inspect(UserStats).identity_key_from_primary_key((user_id,)))
+    if stats is not None:
+        session.expire(stats)
+
+
+def _db_trip_values(session: Session, trip_id: int) -> List[Dict[str, Any]]:
+    """按列读取数据库中的行程（不经过 identity map，拿到的是未 flush 前的旧值）"""
+    rows = session.query(*(getattr(Trip, name) for name in STAT_FIELDS)).filter(Trip.id == trip_id).all()
+    return [dict(zip(STAT_FIELDS, row)) for row in rows]
+
+
+def _compute_stats(session: Session, user_id: int) -> UserStats:
+    """全量计算：按列读取后向量化聚合"""
+    stats = UserStats(user_id=user_id)
+    for name, value in aggregate_trip_columns(load_trip_columns(session, user_id)).items():
+        setattr(stats, name, value)
+    return stats
+
+
+def stats_to_dict(stats: UserStats) -> Dict[str, Any]:
+    return {name: getattr(stats, name) for name in SUM_FIELDS + COUNTER_FIELDS}
+
+
+def rebuild_user_stats(db: Session, user_id: Optional[int] = None) -> int:
+    """全量重建（修复偏差）；不指定 user_id 时重建所有有行程的用户"""
+    user_ids = [user_id] if user_id is not None else [
+        uid for uid, in db.query(Trip.user_id).distinct()
+    ]
+    if user_id is None:
+        db.query(UserStats).delete(synchronize_session=False)
+    for uid in user_ids:
+        db.merge(_compute_stats(db, uid))
+    db.commit()
+    return len(user_ids)
+
+
+def get_user_stats(db: Session, user_id: int) -> UserStats:
+    """
+    读取用户统计行。只读：统计行在注册或首次写行程时创建，
+    尚无统计行的老用户这里现场计算但不落库（--rebuild 可一次性补齐）。
+    """
+    stats = db.get(UserStats, user_id)
+    if stats is None:
+        stats = _compute_stats(db, user_id)
+    return stats
+
+
+def top_counts(counter: Optional[Dict[str, int]], n: int = 5) -> List[tuple]:
+    """按次数降序取前 n 项（次数相同保持首次出现顺序）"""
+    return sorted((counter or {}).items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _track_trip_changes(session: Session, flush_context, instances):
+    """在同一次 flush 中把行程的增删改折算到 user_stats"""
+    changes = []  # (user_id, 贡献, +1/-1)
+    for trip in session.new:
+        if isinstance(trip, Trip):
+            changes.append((trip.user_id, trip_contribution(_pending_trip_values(trip)), 1))
+    with session.no_autoflush:
+        for trip in session.deleted:
+            if isinstance(trip, Trip) and trip.id is not None:
+                for old in _db_trip_values(session, trip.id):
+                    changes.append((old["user_id"], trip_contribution(old), -1))
+        for trip in session.dirty:
+            if not isinstance(trip, Trip) or trip.id is None:
+                continue
+            state = inspect(trip)
+            if not any(state.attrs[name].history.has_changes() for name in STAT_FIELDS):
+                continue
+            for old in _db_trip_values(session, trip.id):
+                changes.append((old["user_id"], trip_contribution(old), -1))
+            values = {name: getattr(trip, name) for name in STAT_FIELDS}
+            changes.append((trip.user_id, trip_contribution(values), 1))
+
+        deltas: Dict[int, Dict[str, Any]] = {}
+        for user_id, contribution, sign in changes:
+            if user_id is not None:
+                _merge_delta(deltas.setdefault(user_id, _empty_delta()), contribution, sign)
+        for user_id, delta in deltas.items():
+            # 首次维护：以 flush 前的数据库状态为基线
+            _ensure_stats_row(session, user_id)
+            _increment_stats(session, user_id, delta)
+
+
+@event.listens_for(User, "after_insert")
+def _create_user_stats(mapper, connection, user: User):
+    """新用户注册时建好空统计行，之后的行程写入只需做增量 UPDATE"""
+    connection.execute(_insert_or_ignore().values(user_id=user.id))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="用户统计物化表维护")
+    parser.add_argument("--rebuild", action="store_true", help="从 trips 表全量重建 user_stats")
+    parser.add_argument("--user-id", type=int, help="只重建指定用户")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+    else:
+        from database import init_db
+        init_db()
+        db = SessionLocal()
+        try:
+            count = rebuild_user_stats(db, args.user_id)
+            print(f"已重建 {count} 个用户的统计")
+        finally:
+            db.close()
@@ -0,0 +1,81 @@
+"""
+预热行程计划缓存：取 trips 表中出现最多的 (目的地, 天数) 组合，
+以 GeneratePlanRequest 的默认参数预先生成计划并写入 plan_cache。
+适合在低峰期离线运行（如 cron）。
+
+用法（在 backend/ 下）:
+    python warm_plan_cache.py [--top 20] [--concurrency 2] [--dry-run]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import func
+
+from database import SessionLocal, Trip, init_db
+from llm_engine import generate_full_plan
+from plan_cache import plan_cache
+from schemas import GeneratePlanRequest
+
+
+def top_destination_days(limit: int):
+    """按出现次数降序返回 [(目的地, 天数, 次数)]"""
+    db = SessionLocal()
+    try:
+        return db.query(Trip.destination, Trip.days, func.count(Trip.id).label("count")) \
+            .filter(Trip.destination.isnot(None), Trip.destination != "") \
+            .group_by(Trip.destination, Trip.days) \
+            .order_by(func.count(Trip.id).desc()) \
+            .limit(limit).all()
+    finally:
+        db.close()
+
+
+async def warm(limit: int, concurrency: int, dry_run: bool):
+    combos = top_destination_days(limit)
+    print(f"热门组合 {len(combos)} 个")
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {"cached": 0, "generated": 0, "failed": 0}
+
+    async def warm_one(destination, days, count):
+        request = GeneratePlanRequest(destination=destination, days=days or 3)
+        fields = request.model_dump()
+        if await asyncio.to_thread(plan_cache.get, fields) is not None:
+            results["cached"] += 1
+            print(f"  已缓存: {destination} {request.days}天（{count} 次）")
+            return
+        if dry_run:
+            print(f"  待生成: {destination} {request.days}天（{count} 次）")
+            return
+        async with semaphore:
+            print(f"  生成中: {destination} {request.days}天（{count} 次）")
+            # generate_full_plan 只在大模型成功返回时写入缓存
+            await generate_full_plan(
+                origin=request.origin,
+                destination=request.destination,
+                days=request.days,
+                people=request.people,
+                preferences=request.preferences,
+                budget=request.budget,
+                transport=request.transport,
+                pace=request.pace,
+                who_with=request.who_with,
+                tags=request.tags,
+            )
+        if await asyncio.to_thread(plan_cache.get, fields) is not None:
+            results["generated"] += 1
+        else:
+            results["failed"] += 1
+            print(f"  生成失败: {destination} {request.days}天")
+
+    await asyncio.gather(*(warm_one(*combo) for combo in combos))
+    print(f"完成: 已有缓存 {results['cached']}，新生成 {results['generated']}，失败 {results['failed']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="预热行程计划缓存")
+    parser.add_argument("--top", type=int, default=20, help="预热的 (目的地, 天数) 组合个数")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时生成的计划数")
+    parser.add_argument("--dry-run", action="store_true", help="只列出待生成的组合")
+    args = parser.parse_args()
+    init_db()
+    asyncio.run(warm(args.top, args.concurrency, args.dry_run))
@@ -1,5 +1,5 @@
 // frontend/src/components/InteractiveDashboard.jsx
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   TrendingUp, Users, MapPin, DollarSign, Calendar, 
   Star, Clock, BarChart3, PieChart, Download,
@@ -34,9 +34,15 @@ import TripGallery from './TripGallery';
 import StatsDetailModal from './StatsDetailModal';
 import { useAuth } from '../contexts/AuthContext';
 import DataAnalysisModal from './DataAnalysisModal';
+// 列表视图只取卡片需要的字段（不含 notes 等大字段），详情/编辑时再按 id 拉取完整记录
+const TRIP_LIST_FIELDS = 'id,name,destination,description,days,people,budget,status,start_date,tags,images,rating,created_at,updated_at';
+const TRIP_PAGE_SIZE = 24;
+
 const InteractiveDashboard = ({ theme, user }) => {
   const [stats, setStats] = useState(null);
   const [trips, setTrips] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [showAddTripModal, setShowAddTripModal] = useState(false);
   const [showTripDetail, setShowTripDetail] = useState(null);
@@ -161,6 +167,51 @@ const InteractiveDashboard = ({ theme, user }) => {
     ]
   };
 
+  const getAuthConfig = () => ({
+    headers: {
+      'Authorization': `Bearer ${localStorage.getItem('access_token')}`
+    }
+  });
+
+  // 按游标拉取一页行程；状态标签交给服务端筛选，翻页时不会漏掉未加载的记录
+  const fetchTripsPage = (cursor = null) => axios.get('http://localhost:8000/api/trips', {
+    ...getAuthConfig(),
+    params: {
+      fields: TRIP_LIST_FIELDS,
+      limit: TRIP_PAGE_SIZE,
+      ...(activeTab !== 'all' ? { status: activeTab } : {}),
+      ...(cursor ? { cursor } : {})
+    }
+  });
+
+  // 加载更多（按需翻页）
+  const loadMoreTrips = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const pageRes = await fetchTripsPage(nextCursor);
+      setTrips(prev => prev.concat(pageRes.data.trips || []));
+      setNextCursor(pageRes.data.next_cursor || null);
+    } catch (error) {
+      console.error('❌ 加载更多行程失败:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // 列表项只有部分字段：查看详情/编辑前拉取完整记录，失败时退回列表数据
+  const withFullTrip = (setter) => async (trip) => {
+    try {
+      const res = await axios.get(`http://localhost:8000/api/trips/${trip.id}`, getAuthConfig());
+      setter(res.data.trip || trip);
+    } catch (error) {
+      console.error('❌ 获取行程详情失败:', error);
+      setter(trip);
+    }
+  };
+  const openTripDetail = withFullTrip(setShowTripDetail);
+  const openTripEdit = withFullTrip(setSelectedTripForEdit);
+
   // 加载数据
   const loadDashboardData = async () => {
     if (!isAuthenticated) {
@@ -191,7 +242,7 @@ const InteractiveDashboard = ({ theme, user }) => {
       
       // 2. 加载行程
       console.log('🗺️ 请求旅行数据...');
-      const tripsRes = await axios.get('http://localhost:8000/api/trips', config);
+      const tripsRes = await fetchTripsPage();
       console.log('🗺️ 旅行数据完整响应:', tripsRes);
       console.log('🗺️ 旅行数据内容:', tripsRes.data);
       
@@ -219,7 +270,10 @@ const InteractiveDashboard = ({ theme, user }) => {
           console.log('✅ 转换对象为数组，数量:', tripsData.length);
         }
       }
-      
+
+      // 接口已分页：这里只取第一页，后续页由“加载更多”按需获取
+      setNextCursor(tripsRes.data?.next_cursor || null);
+
       console.log('🎯 最终设置的 trips 数据:', tripsData);
       setTrips(tripsData);
       
@@ -247,6 +301,7 @@ const InteractiveDashboard = ({ theme, user }) => {
       
       // 设置默认值避免后续错误
       setTrips([]);
+      setNextCursor(null);
       setStats({
         total_trips: 0,
         completed_trips: 0,
@@ -278,10 +333,32 @@ const InteractiveDashboard = ({ theme, user }) => {
     } else {
       setLoading(false);
       setTrips([]);
+      setNextCursor(null);
       setStats(null);
     }
   }, [isAuthenticated, refreshKey]);
 
+  // 切换状态标签后重新拉取第一页（首次渲染由上面的整体加载负责）
+  const tabInitialized = useRef(false);
+  useEffect(() => {
+    if (!tabInitialized.current) {
+      tabInitialized.current = true;
+      return;
+    }
+    if (!isAuthenticated) return;
+
+    let cancelled = false;
+    setNextCursor(null);
+    fetchTripsPage()
+      .then(res => {
+        if (cancelled) return;
+        setTrips(res.data.trips || []);
+        setNextCursor(res.data.next_cursor || null);
+      })
+      .catch(error => console.error('❌ 按状态加载行程失败:', error));
+    return () => { cancelled = true; };
+  }, [activeTab]);
+
   // 添加旅行记录
   const handleAddTrip = () => {
     setShowAddTripModal(true);
@@ -1023,6 +1100,7 @@ const InteractiveDashboard = ({ theme, user }) => {
             <span className="text-sm text-gray-500">
               共 {filteredTrips.length} 条记录
               {trips.length !== filteredTrips.length && `（从${trips.length}条中过滤）`}
+              {searchTerm && nextCursor && '（仅搜索已加载的记录，点击“加载更多”可扩大范围）'}
             </span>
           </div>
         </div>
@@ -1034,10 +1112,10 @@ const InteractiveDashboard = ({ theme, user }) => {
                 <TripCardGrid 
                   key={trip.id}
                   trip={trip}
-                  onViewDetail={() => setShowTripDetail(trip)}
+                  onViewDetail={() => openTripDetail(trip)}
                   onUpdateStatus={(newStatus) => handleUpdateStatus(trip.id, newStatus)}
                   onDelete={() => handleDeleteTrip(trip.id)}
-                  onEdit={() => setSelectedTripForEdit(trip)}
+                  onEdit={() => openTripEdit(trip)}
                 />
               ))}
             </div>
@@ -1047,15 +1125,29 @@ const InteractiveDashboard = ({ theme, user }) => {
                 <TripCardList 
                   key={trip.id}
                   trip={trip}
-                  onViewDetail={() => setShowTripDetail(trip)}
+                  onViewDetail={() => openTripDetail(trip)}
                   onUpdateStatus={(newStatus) => handleUpdateStatus(trip.id, newStatus)}
                   onDelete={() => handleDeleteTrip(trip.id)}
-                  onEdit={() => setSelectedTripForEdit(trip)}
+                  onEdit={() => openTripEdit(trip)}
                 />
               ))}
             </div>
           )
-        ) : (
+        ) : null}
+
+        {nextCursor && (
+          <div className="text-center mt-6">
+            <button
+              onClick={loadMoreTrips}
+              disabled={loadingMore}
+              className="px-6 py-2 rounded-lg border border-green-500 text-green-600 hover:bg-green-50 dark:hover:bg-gray-800 disabled:opacity-50 transition-all"
+            >
+              {loadingMore ? '加载中...' : '加载更多'}
+            </button>
+          </div>
+        )}
+
+        {filteredTrips.length === 0 && (
           <div className="text-center py-12">
             <div className="w-16 h-16 mx-auto mb-4 rounded-full bg-gradient-to-r from-green-500/10 to-yellow-500/10 flex items-center justify-center">
               <MapPin className="w-8 h-8 text-green-500" />